@@ -1,547 +1,686 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, send_file, url_for
 import xlsxwriter
-import io
+import base64
+import contextlib
+import hmac
+import os
+import tempfile
+import time
 from flask_cors import CORS
+from report_admission import Admission, AdmissionRejected, estimate_cost
+from report_batch import get_executor, run_batch, shutdown_executor
+from report_cache import ReportCache, payload_key
+from report_compression import COMPRESSION_PROFILES, DEFAULT_PROFILE, compression_profile
+from report_export import EXPORT_FORMATS, render_json, stream_csv_bundle
+from report_ingest import PayloadError, decode_body, load_payload
+from report_jobs import DONE, ReportJobs
+from report_metrics import REGISTRY, start_request
+from report_preview import PREVIEW_FORMATS, cache_key, chart_models, render_previews
+from report_profiling import PROFILE_KINDS, ProfileCapture
+from report_template import FULL_REPORT, REPORT_TEMPLATE, SheetSelection, render_report_bytes
 
 app = Flask(__name__)
-CORS(app)
+# Let the cross-origin dashboards read the cache validators (to send If-None-Match) and
+# the report/profile headers
+CORS(app, expose_headers=[
+    'ETag', 'X-Report-Cache', 'Content-Disposition',
+    'X-Report-Profile-Id', 'X-Report-Profile-Seconds', 'X-Report-Profile-Peak-Bytes',
+])
+
+# Streaming mode: spool each report to a temp file (in XlsxWriter's constant_memory
+# mode when the row order allows it) and send it back as a chunked response.
+# Can be toggled per request with ?stream=1 / ?stream=0.
+app.config['REPORT_STREAMING'] = os.environ.get('REPORT_STREAMING', '0') == '1'
+app.config['REPORT_TMPDIR'] = os.environ.get('REPORT_TMPDIR') or None
+app.config['REPORT_STREAM_CHUNK_SIZE'] = 64 * 1024
+
+# ZIP compression of the generated workbooks: store, fastest, balanced or smallest.
+# Callers can pick another profile per request with ?compression=<profile>.
+app.config['REPORT_COMPRESSION'] = os.environ.get('REPORT_COMPRESSION', DEFAULT_PROFILE)
+
+# Report cache: finished workbooks keyed by a hash of the canonical payload.
+# REPORT_CACHE_DIR switches from the in-process LRU to files on local disk, shared by
+# (and bounded across) all worker processes pointed at the same directory.
+app.config['REPORT_CACHE_ENABLED'] = os.environ.get('REPORT_CACHE_ENABLED', '1') == '1'
+app.config['REPORT_CACHE_MAX_BYTES'] = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+app.config['REPORT_CACHE_MAX_ENTRIES'] = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 256))
+app.config['REPORT_CACHE_TTL'] = float(os.environ.get('REPORT_CACHE_TTL', 0)) or None
+app.config['REPORT_CACHE_DIR'] = os.environ.get('REPORT_CACHE_DIR') or None
+
+# Batch reports: built in a process pool of BATCH_WORKERS processes
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', 0)) or os.cpu_count()
+app.config['BATCH_MAX_REPORTS'] = int(os.environ.get('BATCH_MAX_REPORTS', 1000))
+
+# Asynchronous report jobs: state in SQLite and finished files under JOBS_DIR,
+# built by JOBS_WORKERS processes and kept for JOBS_RETENTION seconds
+app.config['JOBS_DIR'] = os.environ.get('JOBS_DIR') or os.path.join(tempfile.gettempdir(), 'report-jobs')
+app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 2))
+app.config['JOBS_RETENTION'] = float(os.environ.get('JOBS_RETENTION', 24 * 3600)) or None
+app.config['JOBS_MAX_QUEUED'] = int(os.environ.get('JOBS_MAX_QUEUED', 100))
+
+# Payload limits, enforced before any workbook work starts. Bodies may be JSON or,
+# with msgpack installed, application/msgpack.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+app.config['INGEST_MAX_YEARS'] = int(os.environ.get('INGEST_MAX_YEARS', 100))
+app.config['INGEST_MAX_ROWS'] = int(os.environ.get('INGEST_MAX_ROWS', 20000))
+
+# "Consolidated Totals" source: 'client' uses the table sent in 'consolidated' and derives
+# it from the yearly combined tables only when it is left out; 'server' always derives it.
+app.config['CONSOLIDATED_SOURCE'] = os.environ.get('CONSOLIDATED_SOURCE', 'client')
+
+# Chart previews (SVG / PNG) are cached by chart data hash in PREVIEW_CACHE_DIR, shared by
+# all worker processes so any of them can serve the /previews URLs. Set it empty for an
+# in-process cache; previews are then inlined by default, as other workers could not
+# serve their URLs. Missing PNGs are rendered on the batch process pool when there are
+# at least PREVIEW_PARALLEL_MIN.
+app.config['PREVIEW_CACHE_DIR'] = os.environ.get(
+    'PREVIEW_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'report-previews'),
+) or None
+app.config['PREVIEW_CACHE_MAX_BYTES'] = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+app.config['PREVIEW_CACHE_MAX_ENTRIES'] = int(os.environ.get('PREVIEW_CACHE_MAX_ENTRIES', 4096))
+app.config['PREVIEW_PARALLEL_MIN'] = int(os.environ.get('PREVIEW_PARALLEL_MIN', 8))
+
+# Admission control for single report builds (per server process): builds run while the
+# estimated memory of the admitted ones stays within the budget and at most
+# ADMISSION_MAX_CONCURRENT run at once; the rest queue, or get 429 when the queue is full
+# and 503 after waiting ADMISSION_QUEUE_TIMEOUT seconds.
+app.config['ADMISSION_ENABLED'] = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+app.config['ADMISSION_MEMORY_BUDGET'] = int(os.environ.get('ADMISSION_MEMORY_BUDGET', 512 * 1024 * 1024))
+app.config['ADMISSION_MAX_CONCURRENT'] = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 0)) or os.cpu_count()
+app.config['ADMISSION_MAX_QUEUED'] = int(os.environ.get('ADMISSION_MAX_QUEUED', 32))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30)) or None
+
+# Fraction of report requests that record per-phase timings (0 disables, 1 records all)
+app.config['METRICS_SAMPLE_RATE'] = float(os.environ.get('METRICS_SAMPLE_RATE', 1))
+# Fraction of those that also record the peak memory of the build with tracemalloc
+# (report_peak_memory_bytes). Tracing slows down every thread of the process while it
+# runs, so it is off by default; only one request per process is traced at a time.
+app.config['METRICS_MEMORY_SAMPLE_RATE'] = float(os.environ.get('METRICS_MEMORY_SAMPLE_RATE', 0))
+
+# On-demand profiling of single report requests (X-Report-Profile: 1 or ?profile=1, plus
+# X-Profile-Token matching PROFILING_TOKEN): cProfile + tracemalloc output is written to
+# PROFILING_DIR and can be fetched from /profiles/<id>.txt|.prof with the same token.
+# Off by default, and never active without a token. Profiles are deleted after
+# PROFILING_RETENTION seconds and beyond the newest PROFILING_MAX_PROFILES (0 = no limit).
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '0') == '1'
+app.config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN') or None
+app.config['PROFILING_DIR'] = os.environ.get('PROFILING_DIR') or os.path.join(tempfile.gettempdir(), 'report-profiles')
+app.config['PROFILING_RETENTION'] = float(os.environ.get('PROFILING_RETENTION', 7 * 24 * 3600)) or None
+app.config['PROFILING_MAX_PROFILES'] = int(os.environ.get('PROFILING_MAX_PROFILES', 100))
+
+report_cache = None
+preview_cache = None
+report_jobs = None
+admission = None
+
+
+def collect_service_metrics():
+    # Cache and job queue gauges for /metrics; only for components already in use
+    samples = []
+    if report_cache is not None:
+        stats = report_cache.snapshot()
+        for name in ('hits', 'misses', 'evictions', 'expirations'):
+            samples.append((f'report_cache_{name}_total', f'Report cache {name}.', 'counter', [((), stats[name])]))
+        samples.append(('report_cache_saved_seconds_total', 'Build time saved by cache hits.', 'counter',
+                        [((), stats['saved_seconds'])]))
+        samples.append(('report_cache_bytes', 'Bytes held by the report cache.', 'gauge', [((), stats['bytes'])]))
+    if admission is not None:
+        stats = admission.snapshot()
+        samples.append(('report_admission_in_flight', 'Report builds admitted and running.', 'gauge',
+                        [((), stats['in_flight'])]))
+        samples.append(('report_admission_admitted_bytes', 'Estimated memory of the running report builds.', 'gauge',
+                        [((), stats['admitted_bytes'])]))
+        samples.append(('report_admission_queue_depth', 'Report builds waiting for admission.', 'gauge',
+                        [((), stats['queue_depth'])]))
+        samples.append(('report_admission_rejected_total', 'Report builds turned away by admission control.',
+                        'counter', [((('reason', 'queue_full'),), stats['rejected_full']),
+                                    ((('reason', 'timeout'),), stats['rejected_timeout'])]))
+    if report_jobs is not None:
+        stats = report_jobs.stats()
+        samples.append(('report_jobs', 'Report jobs by state.', 'gauge', [
+            ((('state', state),), stats[state]) for state in ('queue_depth', 'running', 'in_flight', 'done', 'failed')
+        ]))
+        for name in ('latency_seconds', 'queue_wait_seconds'):
+            samples.append((f'report_job_{name}', f'Recent report job {name}.', 'gauge', [
+                ((('quantile', q),), stats[name][key]) for q, key in (('0.5', 'p50'), ('0.95', 'p95'))
+                if stats[name][key] is not None
+            ]))
+    return samples
+
+
+REGISTRY.add_collector(collect_service_metrics)
+
+
+# One small report rendered at start-up: imports XlsxWriter's chart modules, binds the
+# template formats and fills the regex caches before the first real request
+WARM_UP_ENTRIES = [{
+    'year': 2000,
+    'summary': [["Summary", "", ""], ["Scope 1", 1.0, 100]],
+    'comparison': [["Comparison", ""], ["Scope 1", 1.0]],
+    'combined': [["All scopes", "tCO2e"], ["SCOPE 1 - Direct emissions", ""], ["1.1 Warm-up", 1.0], ["TOTAL", 1.0]],
+}]
+WARM_UP_CONSOLIDATED = [["Category", 2000], ["SCOPE 1 - Direct emissions", 1.0], ["1.1 Warm-up", 1.0]]
+
+# Serving state reported by /readyz
+service_state = {'ready': False}
+
+
+def warm_up():
+    if not service_state['ready']:
+        render_report_bytes(WARM_UP_ENTRIES, WARM_UP_CONSOLIDATED)
+        service_state['ready'] = True
+
+
+def shutdown():
+    # Graceful stop, once the worker no longer accepts requests: let running builds finish
+    # and drop queued work. Jobs that were still queued stay queued in the job store and
+    # are recovered on restart.
+    shutdown_executor()
+    if report_jobs is not None:
+        report_jobs.close()
+
+
+def get_admission():
+    global admission
+    if not app.config['ADMISSION_ENABLED']:
+        return None
+    if admission is None:
+        admission = Admission(
+            app.config['ADMISSION_MEMORY_BUDGET'],
+            max_concurrent=app.config['ADMISSION_MAX_CONCURRENT'],
+            max_queued=app.config['ADMISSION_MAX_QUEUED'],
+            queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT'],
+        )
+    return admission
+
+
+@contextlib.contextmanager
+def admitted(entries, consolidated_data, metrics, selection=FULL_REPORT):
+    # Holds an admission slot for the build; raises AdmissionRejected when there is none
+    controller = get_admission()
+    if controller is None:
+        yield
+        return
+    cost = estimate_cost(entries, consolidated_data, selection)
+    with metrics.phase('admission'):
+        controller.acquire(cost)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        controller.release(cost, time.perf_counter() - started)
+
+
+def get_report_cache():
+    global report_cache
+    if not app.config['REPORT_CACHE_ENABLED']:
+        return None
+    if report_cache is None:
+        report_cache = ReportCache(
+            app.config['REPORT_CACHE_MAX_BYTES'],
+            max_entries=app.config['REPORT_CACHE_MAX_ENTRIES'],
+            ttl=app.config['REPORT_CACHE_TTL'],
+            directory=app.config['REPORT_CACHE_DIR'],
+        )
+    return report_cache
 
-@app.route('/process_summary_comparison', methods=['POST'])
-def process_summary_comparison():
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+REPORT_FILENAME = "Summary_Comparison_Report.xlsx"
+
+
+def rows_in_order(entries):
+    # constant_memory flushes each row as soon as a later one is written, so it is only
+    # safe when no table on a "Year {year}" sheet starts above the end of the previous one.
+    # The comparison block is placed using len(summary), so a longer comparison overlaps.
+    return all(len(entry['comparison']) <= len(entry['summary']) + 1 for entry in entries)
+
+
+def stream_file(path, chunk_size):
+    # Send the spooled workbook back in chunks; the response removes it when closed
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def remove_file(path):
     try:
-        # Receive the JSON payload
-        data = request.get_json()
-        entries = data.get('data', [])  # Yearly data
-        consolidated_data = data.get('consolidated', [])  # Consolidated sheet data
-
-        # Create the Excel workbook in memory
-        output = io.BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-
-        # Formats
-        bold_format = workbook.add_format({'bold': True, 'align': 'center', 'valign': 'vcenter'})
-        title_format = workbook.add_format({
-            'bold': True, 'align': 'center', 'valign': 'vcenter', 'font_size': 12, 'bg_color': '#D9E1F2',
-        })
-        center_format = workbook.add_format({'align': 'center', 'valign': 'vcenter'})
-        left_align_format = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
-        decimal_format = workbook.add_format({'num_format': '0.00', 'align': 'center', 'valign': 'vcenter'})
-
-        # Adjust column widths dynamically
-        def adjust_column_widths(worksheet, data):
-            col_widths = {}
-            for row in data:
-                for col_idx, cell in enumerate(row):
-                    col_widths[col_idx] = max(col_widths.get(col_idx, 0), len(str(cell)) + 2)
-            for col_idx, width in col_widths.items():
-                worksheet.set_column(col_idx, col_idx, width)
-
-        # Function to write combined scope data with left alignment for the first column
-        def write_combined_data(worksheet, start_row, data, title_style=None):
-            for row_num, row in enumerate(data):
-                # Apply title styling for the first row in each section
-                if row_num == 0 and title_style:
-                    if len(row) > 1:  # Merge if more than one column
-                        worksheet.merge_range(start_row, 0, start_row, len(row) - 1, row[0], title_style)
-                    else:
-                        worksheet.write(start_row, 0, row[0], title_style)
-                else:
-                    for col_num, cell in enumerate(row):
-                        # Left-align the first column
-                        if col_num == 0:
-                            worksheet.write(start_row + row_num, col_num, cell, left_align_format)
-                        else:
-                            # Apply decimal format if the cell contains a number
-                            if isinstance(cell, (int, float)):
-                                worksheet.write(start_row + row_num, col_num, cell, decimal_format)
-                            else:
-                                worksheet.write(start_row + row_num, col_num, cell, center_format)
-
-        def write_data(worksheet, start_row, data, title_style=None, data_style=center_format):
-            for row_num, row in enumerate(data):
-                if row_num == 0 and title_style:  # Apply title style for first row
-                    # Write the header row with title_style (background color)
-                    for col_num, cell in enumerate(row):
-                        worksheet.write(start_row + row_num, col_num, cell, title_style)
-                else:
-                    for col_num, cell in enumerate(row):
-                       # Apply decimal format if the cell contains a number
-                        if isinstance(cell, (int, float)):
-                            worksheet.write(start_row + row_num, col_num, cell, decimal_format)
-                        else:
-                            worksheet.write(start_row + row_num, col_num, cell, data_style)
-        
-        def write_data_2(worksheet, start_row, data, title_style=None, data_style=center_format):
-            for row_num, row in enumerate(data):
-                if row_num == 0 and title_style:  # Apply title style for first row
-                    # Write the header row with title_style (background color)
-                    for col_num, cell in enumerate(row):
-                        worksheet.write(start_row + row_num, col_num, cell, title_style)
-                else:
-                    for col_num, cell in enumerate(row):
-                       # Apply decimal format if the cell contains a number
-                        if isinstance(cell, (int, float)):
-                            worksheet.write(start_row + row_num, col_num, cell * 0.001, decimal_format)
-                        else:
-                            worksheet.write(start_row + row_num, col_num, cell, data_style)
-
-        def write_consolidated_data(worksheet, start_row, data, title_style=None):
-            for row_num, row in enumerate(data):
-                if row_num == 0 and title_style:  # Apply title style for the header row
-                    for col_num, cell in enumerate(row):
-                        worksheet.write(start_row + row_num, col_num, cell, title_style)
-                else:
-                    for col_num, cell in enumerate(row):
-                        # Align first column to the left for non-header rows
-                        if col_num == 0:
-                            worksheet.write(start_row + row_num, col_num, cell, left_align_format)
-                        else:
-                             # Apply decimal format if the cell contains a number
-                            if isinstance(cell, (int, float)):
-                                worksheet.write(start_row + row_num, col_num, cell, decimal_format)
-                            else:
-                                worksheet.write(start_row + row_num, col_num, cell, center_format)
-                           
-        # Add a function to generate the Scope 1 chart
-        def add_scope1_chart(workbook, worksheet, consolidated_data):
-            # Define rows and columns for the chart
-            years = consolidated_data[0][1:]  # Row 1 (excluding the "Category" header)
-            row_indices = []
-            for idx, row in enumerate(consolidated_data):
-                if row[0].startswith("1.1 ") or row[0].startswith("1.2 ") or row[0].startswith("1.3 ") or row[0].startswith("1.4 "):
-                    row_indices.append(idx)
-
-            # Ensure we have valid rows for the chart
-            if not row_indices:
-                return  # No valid categories found, skip the chart
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            chart = workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
-
-            # Add data series to the chart
-            for i, row_idx in enumerate(row_indices):
-                chart.add_series({
-                    'name': categories[i],
-                    'categories': [worksheet.name, 0, 1, 0, len(years)],  # Years
-                    'values': [worksheet.name, row_idx, 1, row_idx, len(years)],  # Data values
-                })
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-            # Configure chart axes and title
-            chart.set_title({'name': 'Scope 1'})
-            chart.set_x_axis({'name': 'Years'})
-            chart.set_y_axis({'name': 'Emissions (tCO2e)'})
-            chart.set_style(11)
-
-             # Configurar la leyenda con fuente más pequeña
-            chart.set_legend({
-                'font': {'size': 8},  # Ajusta el tamaño de fuente (puedes usar un valor menor o mayor)
-                'position': 'right'   # Opcional: Posicionar la leyenda a la derecha del gráfico
-            })
-
-
-            # Insert column chart into the worksheet
-            worksheet.insert_chart(len(consolidated_data) + 2, 0, chart, {'x_scale': 1.1, 'y_scale': 1.2})
-
-            
-        
-         # Add a function to generate the Scope 1 chart
-        def add_scope2_chart(workbook, worksheet, consolidated_data):
-            # Define rows and columns for the chart
-            years = consolidated_data[0][1:]  # Row 1 (excluding the "Category" header)
-            # Find row indices for categories starting with "2.1" and "2.2"
-            row_indices = []
-            for idx, row in enumerate(consolidated_data):
-                if row[0].startswith("2.1 ") or row[0].startswith("2.2 "):
-                    row_indices.append(idx)
-            
-            # Ensure we have valid rows for the chart
-            if not row_indices:
-                return  # No 2.1 or 2.2 categories found, skip the chart
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            chart = workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
-
-            # Add data series to the chart
-            for i, row_idx in enumerate(row_indices):
-                chart.add_series({
-                    'name': categories[i],
-                    'categories': [worksheet.name, 0, 1, 0, len(years)],  # Years
-                    'values': [worksheet.name, row_idx, 1, row_idx, len(years)],  # Data values
-                })
 
-            # Configure chart axes and title
-            chart.set_title({'name': 'Scope 2'})
-            chart.set_x_axis({'name': 'Years'})
-            chart.set_y_axis({'name': 'Emissions (tCO2e)'})
-            chart.set_style(11)
-
-            chart.set_legend({
-                'font': {'size': 8},  # Ajusta el tamaño de fuente (puedes usar un valor menor o mayor)
-                'position': 'right'   # Opcional: Posicionar la leyenda a la derecha del gráfico
-            })
-
-            # Insert chart into the worksheet
-            worksheet.insert_chart(len(consolidated_data) + 20, 0, chart, {'x_scale': 1.1, 'y_scale': 1.2})
-
-         # Add a function to generate the Scope 1 chart
-        def add_scope3_chart(workbook, worksheet, consolidated_data):
-            # Define rows and columns for the chart
-            years = consolidated_data[0][1:]  # Row 1 (excluding the "Category" header)
-           # Find row indices for categories starting with "2.1" and "2.2"
-            row_indices = []
-            for idx, row in enumerate(consolidated_data):
-                if row[0].startswith("3.1 ") or row[0].startswith("3.2 ") or row[0].startswith("3.3 ") or row[0].startswith("3.4 ") or row[0].startswith("3.5 ") or row[0].startswith("3.6 ") or row[0].startswith("3.7 "):
-                    row_indices.append(idx)
-            
-            # Ensure we have valid rows for the chart
-            if not row_indices:
-                return  # No 2.1 or 2.2 categories found, skip the chart
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            chart = workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
-
-            # Add data series to the chart
-            for i, row_idx in enumerate(row_indices):
-                chart.add_series({
-                    'name': categories[i],
-                    'categories': [worksheet.name, 0, 1, 0, len(years)],  # Years
-                    'values': [worksheet.name, row_idx, 1, row_idx, len(years)],  # Data values
-                })
+FLAG_VALUES = {'1': True, 'true': True, 'yes': True, 'on': True, '0': False, 'false': False, 'no': False, 'off': False}
 
-            # Configure chart axes and title
-            chart.set_title({'name': 'Scope 3'})
-            chart.set_x_axis({'name': 'Years'})
-            chart.set_y_axis({'name': 'Emissions (tCO2e)'})
-            chart.set_style(11)
-
-            chart.set_legend({
-                'font': {'size': 8},  # Ajusta el tamaño de fuente (puedes usar un valor menor o mayor)
-                'position': 'right'   # Opcional: Posicionar la leyenda a la derecha del gráfico
-            })
-
-            # Insert chart into the worksheet
-            worksheet.insert_chart(len(consolidated_data) + 2 + 36, 0, chart, {'x_scale': 1.1, 'y_scale': 1.2})
-        
-         # Add a function to generate the Scope 1 chart
-        def add_scope1and2_chart(workbook, worksheet, consolidated_data):
-            # Define rows and columns for the chart
-            years = consolidated_data[0][1:]  # Row 1 (excluding the "Category" header)
-           # Find row indices for categories starting with "2.1" and "2.2"
-            row_indices = []
-            for idx, row in enumerate(consolidated_data):
-                if row[0].startswith("SCOPE 1") or row[0].startswith("SCOPE 2"):
-                    row_indices.append(idx)
-            
-            # Ensure we have valid rows for the chart
-            if not row_indices:
-                return  # No 2.1 or 2.2 categories found, skip the chart
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            chart = workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
-
-            # Add data series to the chart
-            for i, row_idx in enumerate(row_indices):
-                chart.add_series({
-                    'name': categories[i],
-                    'categories': [worksheet.name, 0, 1, 0, len(years)],  # Years
-                    'values': [worksheet.name, row_idx, 1, row_idx, len(years)],  # Data values
-                })
 
-            # Configure chart axes and title
-            chart.set_title({'name': 'Scope 1 & 2'})
-            chart.set_x_axis({'name': 'Years'})
-            chart.set_y_axis({'name': 'Emissions (tCO2e)'})
-            chart.set_style(11)
-
-            # Insert chart into the worksheet
-            worksheet.insert_chart(0, 6, chart)
-
-         # Add a function to generate the Scope 1 chart
-        def add_scope1and2and3_chart(workbook, worksheet, consolidated_data):
-            # Define rows and columns for the chart
-            years = consolidated_data[0][1:]  # Row 1 (excluding the "Category" header)
-           # Find row indices for categories starting with "2.1" and "2.2"
-            row_indices = []
-            for idx, row in enumerate(consolidated_data):
-                if row[0].startswith("SCOPE 1") or row[0].startswith("SCOPE 2") or row[0].startswith("SCOPE 3"):
-                    row_indices.append(idx)
-            
-            # Ensure we have valid rows for the chart
-            if not row_indices:
-                return  # No 2.1 or 2.2 categories found, skip the chart
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            categories = [consolidated_data[row_idx][0] for row_idx in row_indices]  # Category names
-            chart = workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
-
-            # Add data series to the chart
-            for i, row_idx in enumerate(row_indices):
-                chart.add_series({
-                    'name': categories[i],
-                    'categories': [worksheet.name, 0, 1, 0, len(years)],  # Years
-                    'values': [worksheet.name, row_idx, 1, row_idx, len(years)],  # Data values
-                })
+def flag(value, name, default=False):
+    # Boolean query parameter / header value; default when it is absent, 400 for anything
+    # that is not one of FLAG_VALUES (an empty value included)
+    if value is None:
+        return default
+    try:
+        return FLAG_VALUES[value.lower()]
+    except KeyError:
+        raise PayloadError(400, f"{name} must be one of {', '.join(FLAG_VALUES)}") from None
+
+
+def wants_streaming():
+    return flag(request.args.get('stream'), 'stream', app.config['REPORT_STREAMING'])
+
+
+def requested_compression():
+    profile = request.args.get('compression') or app.config['REPORT_COMPRESSION']
+    if profile not in COMPRESSION_PROFILES:
+        raise PayloadError(400, f"compression must be one of {', '.join(COMPRESSION_PROFILES)}")
+    return profile
+
+
+def requested_selection(entries):
+    # ?sheets=consolidated,2021 builds only the named sheets ("consolidated", years, or
+    # "years" for every year; default all) and ?charts=0 leaves the charts out
+    charts = flag(request.args.get('charts'), 'charts', True)
+    sheets = request.args.get('sheets')
+    if sheets is None:
+        return SheetSelection(charts=charts)
+    names = [name.strip() for name in sheets.split(',') if name.strip()]
+    if not names:
+        raise PayloadError(400, "sheets must name at least one sheet")
+    if 'years' in names:
+        years = None
+    else:
+        years = [name for name in names if name != 'consolidated']
+        known = {str(entry['year']) for entry in entries}
+        unknown = [year for year in years if year not in known]
+        if unknown:
+            raise PayloadError(400, f"sheets: no data for {', '.join(unknown)}")
+    return SheetSelection(consolidated='consolidated' in names, years=years, charts=charts)
+
+
+def requested_format():
+    # ?format=xlsx|csv|json wins; otherwise the Accept header picks CSV or JSON only when
+    # it does not accept the XLSX type (so "*/*" and browser defaults keep getting XLSX)
+    name = request.args.get('format')
+    if name is not None:
+        if name != 'xlsx' and name not in EXPORT_FORMATS:
+            raise PayloadError(400, f"format must be one of xlsx, {', '.join(EXPORT_FORMATS)}")
+        return name
+    accept = request.accept_mimetypes
+    if not accept or accept[XLSX_MIMETYPE]:
+        return 'xlsx'
+    for name, spec in EXPORT_FORMATS.items():
+        if any(accept[mimetype] for mimetype in spec['accept']):
+            return name
+    raise PayloadError(406, f"can only produce {XLSX_MIMETYPE}, text/csv (zip bundle) or application/json")
+
+
+def export_response(name, entries, consolidated_data, metrics, selection=FULL_REPORT):
+    # CSV / JSON exports: no workbook, no charts, not cached (they are cheap to build)
+    spec = EXPORT_FORMATS[name]
+    with metrics.phase('export'):
+        if name == 'json':
+            body = render_json(entries, consolidated_data, selection=selection)
+            metrics.count('bytes', len(body))
+        else:
+            body = stream_csv_bundle(entries, consolidated_data, selection=selection)
+    metrics.publish('exported')
+    return Response(
+        body,
+        mimetype=spec['mimetype'],
+        headers={"Content-Disposition": f"attachment;filename={spec['filename']}", "Vary": "Accept"},
+    )
+
+
+def get_preview_cache():
+    global preview_cache
+    if preview_cache is None:
+        preview_cache = ReportCache(
+            app.config['PREVIEW_CACHE_MAX_BYTES'], max_entries=app.config['PREVIEW_CACHE_MAX_ENTRIES'],
+            directory=app.config['PREVIEW_CACHE_DIR'], suffix='.preview',
+        )
+    return preview_cache
 
-            # Configure chart axes and title
-            chart.set_title({'name': 'Scopes'})
-            chart.set_x_axis({'name': 'Years'})
-            chart.set_y_axis({'name': 'Emissions (tCO2e)'})
-            chart.set_style(11)
-
-            # Insert chart into the worksheet
-            worksheet.insert_chart(16, 6, chart)
-
-        # Add Consolidated Totals sheet
-        consolidated_sheet = workbook.add_worksheet("Consolidated Totals")
-        write_consolidated_data(consolidated_sheet, 0, consolidated_data, title_style=title_format)
-        adjust_column_widths(consolidated_sheet, consolidated_data)
-
-        # Add the Scope 1 chart
-        add_scope1_chart(workbook, consolidated_sheet, consolidated_data)
-        add_scope2_chart(workbook, consolidated_sheet, consolidated_data)
-        add_scope3_chart(workbook, consolidated_sheet, consolidated_data)
-        add_scope1and2_chart(workbook, consolidated_sheet, consolidated_data)
-        add_scope1and2and3_chart(workbook, consolidated_sheet, consolidated_data)
-
-          # Process each year's data
-       # Crear gráficos de tipo pie directamente en las hojas de cada año
-      # Crear gráficos de tipo pie en una nueva hoja para cada año
-        for entry in entries:
-            year = entry['year']
-            summary = entry['summary']
-            comparison = entry['comparison']
-            combined = entry['combined']
-
-            # Crear la hoja principal del año con los datos originales
-            worksheet_data = workbook.add_worksheet(f"Year {year}")
-            row_cursor = 0
-
-            # Escribir los datos de resumen y combinados
-            write_data(worksheet_data, row_cursor, summary, title_style=title_format)
-            row_cursor += len(summary) + 1
-
-              # Escribir los datos de resumen y combinados
-            write_data(worksheet_data, row_cursor, comparison, title_style=title_format)
-            row_cursor += len(summary) + 1
-
-            write_combined_data(worksheet_data, row_cursor, combined, title_style=title_format)
-            row_cursor += len(combined)
-
-            
-
-            # Ajustar anchos de columna
-            adjust_column_widths(worksheet_data, summary + comparison + combined)
-
-            # Definir las celdas específicas para Scope 1, 2 y 3 en la tabla de resumen
-            scope_categories = ['Scope 1', 'Scope 2', 'Scope 3']
-            category_start_row = 1  # Fila donde comienza Scope 1 (indexada desde 0)
-            category_column = 0  # Columna de categorías
-            value_column = 1  # Columna de valores (Emissionen (tCO2e))
-
-            # Escribir las categorías y valores relevantes temporalmente si es necesario
-            chart_categories_range = [worksheet_data.name, category_start_row + 1, category_column, category_start_row + 3, category_column]
-            chart_values_range = [worksheet_data.name, category_start_row + 1, value_column, category_start_row + 3, value_column]
-            print(chart_categories_range,chart_values_range)
-
-            # Crear el gráfico pie
-            pie_chart_scopes = workbook.add_chart({'type': 'pie'})
-            pie_chart_scopes.add_series({
-                'name': f'Total Emissions (Scopes 1, 2, 3) - {year}',
-                'categories': chart_categories_range,
-                'values': chart_values_range,
-               'data_labels': {'value': True, 'percentage': True}
-            })
-            pie_chart_scopes.set_title({'name': f'Scope 1, 2, 3 ({year})'})
-
-            table_start_row = 1
-            table_start_col = 0
-            table_width = 4  # Número de columnas ocupadas por la tabla
-            chart_row = table_start_row  # Alinea el gráfico con el inicio de la tabla
-            chart_col = table_start_col + table_width + 1  # Coloca el gráfico a la derecha de la tabla
-
-            # Insertar el gráfico a la derecha de la tabla
-            worksheet_data.insert_chart(chart_row, chart_col, pie_chart_scopes)
-
-            # Crear una nueva hoja para los gráficos del año
-            worksheet_chart = workbook.add_worksheet(f"Year Chart {year}")
-
-            # Inicializar posición para escribir datos y gráficos en la hoja de gráficos
-            temp_start_row = 0
-            temp_start_col = 0
-
-            # === LÓGICA PARA SCOPE 1 ===
-            scope1_start = None
-            scope1_end = None
-            for row_idx, row in enumerate(combined):
-                if "SCOPE 1 - Direkte Emissionen" in row[0] or "SCOPE 1 - Direct emissions" in row[0]:
-                    scope1_start = row_idx + 1  # Primera fila después del encabezado
-                if scope1_start and "GESAMT" in row[0]:  # Detectar el final del bloque Scope 1
-                    scope1_end = row_idx
-                    break
-                if scope1_start and "TOTAL" in row[0]:  # Detectar el final del bloque Scope 1
-                    scope1_end = row_idx
-                    break
-
-            if scope1_start and scope1_end:
-                print("step 1")
-                relevant_rows_scope1 = [
-                    row_idx for row_idx in range(scope1_start, scope1_end)
-                    if combined[row_idx][0].startswith(("1.1 ", "1.2 ", "1.3 ", "1.4 "))
-                    and not combined[row_idx][0].startswith(("1.1.1", "1.1.2"))
-                ]
-                if relevant_rows_scope1:
-                    print("step 2")
-                    # Agregar encabezado "tCO₂" en la segunda columna
-                    worksheet_chart.write(temp_start_row, temp_start_col + 1, "tCO₂", title_format)  # Fila inicial, columna 2
-                    temp_start_row += 1  # Avanzar una fila para no sobreescribir el encabezado
-
-                    for i, idx in enumerate(relevant_rows_scope1):
-                        worksheet_chart.write(temp_start_row + i, temp_start_col, combined[idx][0])  # Categorías
-                        worksheet_chart.write(temp_start_row + i, temp_start_col + 1, combined[idx][1],decimal_format)  # Valores
-                    categories_range_scope1 = [worksheet_chart.name, temp_start_row, temp_start_col, temp_start_row + len(relevant_rows_scope1) - 1, temp_start_col]
-                    values_range_scope1 = [worksheet_chart.name, temp_start_row, temp_start_col + 1, temp_start_row + len(relevant_rows_scope1) - 1, temp_start_col + 1]
-                    pie_chart_scope1 = workbook.add_chart({'type': 'pie'})
-                    pie_chart_scope1.add_series({
-                        'name': f'Scope 1 Emissions for {year}',
-                        'categories': categories_range_scope1,
-                        'values': values_range_scope1,
-                        'data_labels': {'value': True, 'percentage': True}
-                    })
-                    pie_chart_scope1.set_title({'name': f'Scope 1 ({year})'})
-                    # Calcular la posición adecuada para insertar el gráfico
-                    table_start_row = 1
-                    table_start_col = 0
-                    table_width = 4  # Número de columnas ocupadas por la tabla
-                    chart_row = table_start_row  # Alinea el gráfico con el inicio de la tabla
-                    chart_col = table_start_col + table_width + 1  # Coloca el gráfico a la derecha de la tabla
-
-                    # Configurar la leyenda con fuente más pequeña
-                    pie_chart_scope1.set_legend({
-                        'font': {'size': 8},  # Ajusta el tamaño de fuente (puedes usar un valor menor o mayor)
-                        'position': 'right'   # Opcional: Posicionar la leyenda a la derecha del gráfico
-                    })
-
-                    # Insertar el gráfico a la derecha de la tabla
-                    worksheet_chart.insert_chart(chart_row, chart_col, pie_chart_scope1,  {'x_scale': 1.5, 'y_scale': 1})
-                    # Ajustar anchos de columna para la tabla escrita
-                    adjust_column_widths(worksheet_chart, [[combined[idx][0], combined[idx][1]] for idx in relevant_rows_scope1])
-
-                    temp_start_row += len(relevant_rows_scope1) + 15  # Espacio para el siguiente bloque
-
-            # === LÓGICA PARA SCOPE 2 ===
-            scope2_start = None
-            scope2_end = None
-            for row_idx, row in enumerate(combined):
-                if "SCOPE 2" in row[0]:
-                    scope2_start = row_idx + 1  # Primera fila después del encabezado
-                if scope2_start and "GESAMT" in row[0]:  # Detectar el final del bloque Scope 2
-                    scope2_end = row_idx
-                    break
-                if scope2_start and "TOTAL" in row[0]:  # Detectar el final del bloque Scope 1
-                    scope2_end = row_idx
-                    break
-
-            if scope2_start and scope2_end:
-                relevant_rows_scope2 = [
-                    row_idx for row_idx in range(scope2_start, scope2_end)
-                    if combined[row_idx][0].startswith(("2.1", "2.2"))
-                ]
-                if relevant_rows_scope2:
-                    # Agregar encabezado "tCO₂" en la segunda columna
-                    worksheet_chart.write(temp_start_row, temp_start_col + 1, "tCO₂", title_format)  # Fila inicial, columna 2
-                    temp_start_row += 1  # Avanzar una fila para no sobreescribir el encabezado
-                    for i, idx in enumerate(relevant_rows_scope2):
-                        worksheet_chart.write(temp_start_row + i, temp_start_col, combined[idx][0])  # Categorías
-                        worksheet_chart.write(temp_start_row + i, temp_start_col + 1, combined[idx][1], decimal_format)  # Valores
-                    categories_range_scope2 = [worksheet_chart.name, temp_start_row, temp_start_col, temp_start_row + len(relevant_rows_scope2) - 1, temp_start_col]
-                    values_range_scope2 = [worksheet_chart.name, temp_start_row, temp_start_col + 1, temp_start_row + len(relevant_rows_scope2) - 1, temp_start_col + 1]
-                    pie_chart_scope2 = workbook.add_chart({'type': 'pie'})
-                    pie_chart_scope2.add_series({
-                        'name': f'Scope 2 Emissions for {year}',
-                        'categories': categories_range_scope2,
-                        'values': values_range_scope2,
-                        'data_labels': {'value': True, 'percentage': True}
-                    })
-                    pie_chart_scope2.set_title({'name': f'Scope 2 ({year})'})
-                     # Calcular la posición adecuada para insertar el gráfico
-                    table_start_row = 17
-                    table_start_col = 0
-                    table_width = 4  # Número de columnas ocupadas por la tabla
-                    chart_row = table_start_row  # Alinea el gráfico con el inicio de la tabla
-                    chart_col = table_start_col + table_width + 1  # Coloca el gráfico a la derecha de la tabla
-
-                     # Configurar la leyenda con fuente más pequeña
-                    pie_chart_scope2.set_legend({
-                        'font': {'size': 8},  # Ajusta el tamaño de fuente (puedes usar un valor menor o mayor)
-                        'position': 'right'   # Opcional: Posicionar la leyenda a la derecha del gráfico
-                    })
-                    # Insertar el gráfico a la derecha de la tabla
-                    worksheet_chart.insert_chart(chart_row, chart_col, pie_chart_scope2, {'x_scale': 1.5, 'y_scale': 1})
-                    temp_start_row += len(relevant_rows_scope2) + 15  # Espacio para el siguiente bloque
-
-            # === LÓGICA PARA SCOPE 3 ===
-            scope3_start = None
-            scope3_end = None
-            for row_idx, row in enumerate(combined):
-                if "SCOPE 3" in row[0]:
-                    scope3_start = row_idx + 1  # Primera fila después del encabezado
-                if scope3_start and "GESAMT" in row[0]:  # Detectar el final del bloque Scope 3
-                    scope3_end = row_idx
-                    break
-                if scope3_start and "TOTAL" in row[0]:  # Detectar el final del bloque Scope 1
-                    scope3_end = row_idx
-                    break
-
-            if scope3_start and scope3_end:
-                relevant_rows_scope3 = [
-                    row_idx for row_idx in range(scope3_start, scope3_end)
-                    if combined[row_idx][0].startswith(("3.1 ", "3.2 ", "3.3 ", "3.4 ", "3.5 ", "3.6 ", "3.7 "))
-                ]
-                if relevant_rows_scope3:
-                     # Agregar encabezado "tCO₂" en la segunda columna
-                    worksheet_chart.write(temp_start_row, temp_start_col + 1, "tCO₂", title_format)  # Fila inicial, columna 2
-                    temp_start_row += 1  # Avanzar una fila para no sobreescribir el encabezado
-                    for i, idx in enumerate(relevant_rows_scope3):
-                        worksheet_chart.write(temp_start_row + i, temp_start_col, combined[idx][0])  # Categorías
-                        worksheet_chart.write(temp_start_row + i, temp_start_col + 1, combined[idx][1], decimal_format)  # Valores
-                    categories_range_scope3 = [worksheet_chart.name, temp_start_row, temp_start_col, temp_start_row + len(relevant_rows_scope3) - 1, temp_start_col]
-                    values_range_scope3 = [worksheet_chart.name, temp_start_row, temp_start_col + 1, temp_start_row + len(relevant_rows_scope3) - 1, temp_start_col + 1]
-                    pie_chart_scope3 = workbook.add_chart({'type': 'pie'})
-                    pie_chart_scope3.add_series({
-                        'name': f'Scope 3 Emissions for {year}',
-                        'categories': categories_range_scope3,
-                        'values': values_range_scope3,
-                        'data_labels': {'value': True, 'percentage': True}
-                    })
-                    pie_chart_scope3.set_title({'name': f'Scope 3 ({year})'})
-                      # Calcular la posición adecuada para insertar el gráfico
-                    table_start_row = 33
-                    table_start_col = 0
-                    table_width = 4  # Número de columnas ocupadas por la tabla
-                    chart_row = table_start_row  # Alinea el gráfico con el inicio de la tabla
-                    chart_col = table_start_col + table_width + 1  # Coloca el gráfico a la derecha de la tabla
-
-                     # Configurar la leyenda con fuente más pequeña
-                    pie_chart_scope3.set_legend({
-                        'font': {'size': 8},  # Ajusta el tamaño de fuente (puedes usar un valor menor o mayor)
-                        'position': 'right'   # Opcional: Posicionar la leyenda a la derecha del gráfico
-                    })
-                    # Insertar el gráfico a la derecha de la tabla
-                    worksheet_chart.insert_chart(chart_row, chart_col, pie_chart_scope3, {'x_scale': 1.5, 'y_scale': 1})
-                    temp_start_row += len(relevant_rows_scope3) + 15  # Espacio para el siguiente bloque
-
-      
-
-        # Close the workbook
-        workbook.close()
-        output.seek(0)
-
-        return Response(
-            output.read(),
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment;filename=Summary_Comparison_Report.xlsx"}
+
+def get_report_jobs():
+    global report_jobs
+    if report_jobs is None:
+        report_jobs = ReportJobs(
+            app.config['JOBS_DIR'],
+            app.config['JOBS_WORKERS'],
+            retention=app.config['JOBS_RETENTION'],
+            max_queued=app.config['JOBS_MAX_QUEUED'],
         )
+    return report_jobs
+
+
+def ingest_options(max_bytes=True):
+    options = {
+        'max_years': app.config['INGEST_MAX_YEARS'],
+        'max_rows': app.config['INGEST_MAX_ROWS'],
+        'derive_consolidated': app.config['CONSOLIDATED_SOURCE'] == 'server',
+    }
+    if max_bytes:
+        options['max_bytes'] = app.config['MAX_CONTENT_LENGTH']
+    return options
+
+
+def report_response(body, key=None, cache_status=None):
+    response = Response(
+        body,
+        mimetype=XLSX_MIMETYPE,
+        headers={"Content-Disposition": f"attachment;filename={REPORT_FILENAME}", "Vary": "Accept"},
+    )
+    if key is not None:
+        # Weak: the key names the report content, not the exact bytes (a rebuild after
+        # eviction or another worker's build may zip differently)
+        response.set_etag(key, weak=True)
+        response.headers['X-Report-Cache'] = cache_status
+    return response
+
+
+# Build the workbook (spooled to a temp file when streaming, in memory otherwise) and cache it
+def build_report_response(entries, consolidated_data, cache, key, compression, metrics, selection=FULL_REPORT,
+                          streaming=False):
+    started = time.perf_counter()
+
+    if streaming:
+        # Spool the workbook to a temp file and stream it back chunk by chunk
+        tmpdir = app.config['REPORT_TMPDIR']
+        fd, path = tempfile.mkstemp(suffix='.xlsx', dir=tmpdir)
+        os.close(fd)
+        try:
+            with metrics.memory():
+                workbook = xlsxwriter.Workbook(path, {
+                    'constant_memory': rows_in_order(entries),
+                    'tmpdir': tmpdir,
+                })
+                REPORT_TEMPLATE.render(workbook, entries, consolidated_data, metrics, selection)
+                with metrics.phase('close'), compression_profile(compression):
+                    workbook.close()
+            metrics.count('bytes', os.path.getsize(path))
+            if cache is not None:
+                cache.put_file(key, path, time.perf_counter() - started)
+        except Exception:
+            os.remove(path)
+            raise
+        metrics.publish('built')
+        response = report_response(stream_file(path, app.config['REPORT_STREAM_CHUNK_SIZE']), key, 'MISS')
+        # Runs when the server closes the response, also if the body was never iterated
+        # (client gone before the first chunk), which a finally in the generator misses
+        response.call_on_close(lambda: remove_file(path))
+        return response
+
+    # Create the Excel workbook in memory
+    with metrics.memory():
+        body = render_report_bytes(entries, consolidated_data, metrics, compression, selection)
+    with metrics.phase('response'):
+        if cache is not None:
+            cache.put(key, body, time.perf_counter() - started)
+        response = report_response(body, key, 'MISS')
+    metrics.publish('built')
+    return response
+
+
+def profiling_authorized():
+    token = app.config['PROFILING_TOKEN']
+    supplied = request.headers.get('X-Profile-Token')
+    return token is not None and supplied is not None and hmac.compare_digest(supplied, token)
+
+
+def wants_profile():
+    # Only looked at when profiling is enabled, so other requests pay nothing for it
+    return flag(request.headers.get('X-Report-Profile') or request.args.get('profile'), 'profile')
+
+
+@app.route('/process_summary_comparison', methods=['POST'])
+def process_summary_comparison():
+    try:
+        profile = app.config['PROFILING_ENABLED'] and wants_profile()
+    except PayloadError as e:
+        return jsonify({"error": e.message}), e.status
+    if not profile:
+        return summary_comparison_response()
+    if not profiling_authorized():
+        return jsonify({"error": "profiling requires a valid X-Profile-Token"}), 403
+
+    capture = ProfileCapture(
+        app.config['PROFILING_DIR'], f"{request.method} {request.full_path.rstrip('?')}",
+        retention=app.config['PROFILING_RETENTION'], max_profiles=app.config['PROFILING_MAX_PROFILES'],
+    )
+    if not capture.start():
+        return jsonify({"error": "another request is being profiled, try again later"}), 429, {'Retry-After': '1'}
+    try:
+        # Bypass the report cache so the profile covers a real build
+        response = app.make_response(summary_comparison_response(use_cache=False))
+    finally:
+        summary = capture.stop()
+    response.headers['X-Report-Profile-Id'] = summary['id']
+    response.headers['X-Report-Profile-Seconds'] = f"{summary['seconds']:.3f}"
+    response.headers['X-Report-Profile-Peak-Bytes'] = str(summary['peak_traced_bytes'])
+    return response
+
+
+def summary_comparison_response(use_cache=True):
+    metrics = start_request(
+        'process_summary_comparison', app.config['METRICS_SAMPLE_RATE'], app.config['METRICS_MEMORY_SAMPLE_RATE'],
+    )
+    try:
+        # Receive and validate the payload: yearly data and the consolidated sheet data
+        with metrics.phase('parse'):
+            entries, consolidated_data = load_payload(request, **ingest_options())
+            export = requested_format()
+            compression = requested_compression()
+            selection = requested_selection(entries)
+            streaming = wants_streaming()
+
+        if export != 'xlsx':
+            return export_response(export, entries, consolidated_data, metrics, selection)
+
+        cache = get_report_cache() if use_cache else None
+        key = None
+        if cache is not None:
+            with metrics.phase('cache_lookup'):
+                key = payload_key(entries, consolidated_data, compression, *selection.cache_key())
+                # The key is content-addressed, so a matching ETag means the client already has this report
+                if request.if_none_match.contains_weak(key):
+                    response = Response(status=304)
+                    response.set_etag(key, weak=True)
+                    metrics.publish('not_modified')
+                    return response
+                cached = cache.get(key)
+            if cached is not None:
+                metrics.publish('cache_hit')
+                return report_response(cached, key, 'HIT')
+
+        with admitted(entries, consolidated_data, metrics, selection):
+            return build_report_response(
+                entries, consolidated_data, cache, key, compression, metrics, selection, streaming,
+            )
+    except AdmissionRejected as e:
+        metrics.publish('shed')
+        return jsonify({"error": e.message}), e.status, {'Retry-After': str(e.retry_after)}
+    except PayloadError as e:
+        metrics.publish('rejected')
+        return jsonify({"error": e.message}), e.status
     except Exception as e:
-        print("Error:", str(e))
+        app.logger.exception("Report generation failed")
+        metrics.publish('error')
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/process_summary_comparison/batch', methods=['POST'])
+def process_summary_comparison_batch():
+    # {"reports": [{"name": "...", "data": [...], "consolidated": [...]}, ...]}
+    # -> ZIP with one workbook per report plus manifest.json, streamed as reports finish
+    try:
+        data = decode_body(request, app.config['MAX_CONTENT_LENGTH'])
+        compression = requested_compression()
+    except PayloadError as e:
+        return jsonify({"error": e.message}), e.status
+    reports = data.get('reports') if isinstance(data, dict) else None
+    if not isinstance(reports, list) or not reports:
+        return jsonify({"error": "'reports' must be a non-empty list"}), 400
+    if len(reports) > app.config['BATCH_MAX_REPORTS']:
+        return jsonify({"error": f"at most {app.config['BATCH_MAX_REPORTS']} reports per batch"}), 413
+
+    chunks = run_batch(
+        reports, app.config['BATCH_WORKERS'], cache=get_report_cache(), key_for=payload_key,
+        limits=ingest_options(max_bytes=False),
+        compression=compression,
+    )
+    return Response(
+        chunks,
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment;filename=Summary_Comparison_Reports.zip"},
+    )
+
+
+@app.route('/process_summary_comparison/preview', methods=['POST'])
+def preview_summary_comparison():
+    # Same payload as /process_summary_comparison -> the report's charts as images:
+    # {"charts": [{"id", "sheet", "title", "type", "url", "cached"[, "data"]}]}
+    # ?format=svg (default) or png; ?inline=1 embeds each image as a data: URI (the
+    # default when previews are cached per process)
+    fmt = request.args.get('format', 'svg')
+    if fmt not in PREVIEW_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(PREVIEW_FORMATS)}"}), 400
+    try:
+        inline = flag(request.args.get('inline'), 'inline', not app.config['PREVIEW_CACHE_DIR'])
+        entries, consolidated_data = load_payload(request, **ingest_options())
+    except PayloadError as e:
+        return jsonify({"error": e.message}), e.status
+
+    charts = chart_models(entries, consolidated_data)
+    executor = get_executor(app.config['BATCH_WORKERS']) if app.config['BATCH_WORKERS'] > 1 else None
+    rendered = render_previews(
+        charts, fmt, cache=get_preview_cache(), executor=executor, min_parallel=app.config['PREVIEW_PARALLEL_MIN'],
+    )
+    mimetype = PREVIEW_FORMATS[fmt][0]
+    items = []
+    for chart, (key, image, cached) in zip(charts, rendered):
+        item = {
+            "id": chart['id'],
+            "sheet": chart['sheet'],
+            "title": chart['title'],
+            "type": chart['type'],
+            "url": url_for('chart_preview', key=key, fmt=fmt),
+            "cached": cached,
+        }
+        if inline:
+            item["data"] = f"data:{mimetype};base64,{base64.b64encode(image).decode('ascii')}"
+        items.append(item)
+    return jsonify({"format": fmt, "charts": items})
+
+
+@app.route('/previews/<key>.<fmt>', methods=['GET'])
+def chart_preview(key, fmt):
+    if fmt not in PREVIEW_FORMATS:
+        return jsonify({"error": "unknown preview format"}), 404
+    image = get_preview_cache().get(cache_key(key, fmt))
+    if image is None:
+        return jsonify({"error": "preview expired, request it again"}), 404
+    response = Response(image, mimetype=PREVIEW_FORMATS[fmt][0])
+    # Content-addressed, so it never changes
+    response.set_etag(key)
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
+
+
+@app.route('/profiles/<profile_id>.<kind>', methods=['GET'])
+def report_profile(profile_id, kind):
+    if not app.config['PROFILING_ENABLED']:
+        return jsonify({"error": "profiling is disabled"}), 404
+    if not profiling_authorized():
+        return jsonify({"error": "profiles require a valid X-Profile-Token"}), 403
+    path = os.path.join(app.config['PROFILING_DIR'], f"{profile_id}.{kind}")
+    if kind not in PROFILE_KINDS or not profile_id.replace('-', '').isalnum() or not os.path.exists(path):
+        return jsonify({"error": "unknown profile"}), 404
+    return send_file(path, mimetype=PROFILE_KINDS[kind], as_attachment=kind == 'prof', download_name=f"{profile_id}.{kind}")
+
+
+@app.route('/jobs/process_summary_comparison', methods=['POST'])
+def submit_summary_comparison_job():
+    try:
+        entries, consolidated_data = load_payload(request, **ingest_options())
+        compression = requested_compression()
+    except PayloadError as e:
+        return jsonify({"error": e.message}), e.status
+    job_id = get_report_jobs().submit({'data': entries, 'consolidated': consolidated_data, 'compression': compression})
+    if job_id is None:
+        return jsonify({"error": "job queue is full"}), 503, {'Retry-After': '30'}
+    status_url = url_for('report_job_status', job_id=job_id)
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": status_url,
+        "download_url": url_for('report_job_download', job_id=job_id),
+    }), 202, {'Location': status_url}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def report_job_status(job_id):
+    job = get_report_jobs().get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def report_job_download(job_id):
+    jobs = get_report_jobs()
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job"}), 404
+    if job['status'] != DONE:
+        return jsonify(job), 409
+    return send_file(
+        jobs.result_path(job_id), mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=REPORT_FILENAME,
+    )
+
+
+@app.route('/jobs/stats', methods=['GET'])
+def report_jobs_stats():
+    return jsonify(get_report_jobs().stats())
+
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    controller = get_admission()
+    if controller is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(controller.snapshot(), enabled=True))
+
+
+@app.route('/report_cache/stats', methods=['GET'])
+def report_cache_stats():
+    cache = get_report_cache()
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(cache.snapshot(), enabled=True))
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up and answering
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: warmed up; load balancers should only route here on 200
+    if not service_state['ready']:
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready", "pid": os.getpid()})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only; production runs through wsgi.py (see gunicorn.conf.py)
+    warm_up()
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=os.environ.get('FLASK_DEBUG', '0') == '1')
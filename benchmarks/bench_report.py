@@ -0,0 +1,146 @@
+"""Benchmark the /process_summary_comparison pipeline.
+
+Every scenario runs in a fresh subprocess (so peak RSS is per scenario) and drives the
+endpoint through Flask's test client with the report cache off:
+
+    python benchmarks/bench_report.py --output results.json
+    python benchmarks/bench_report.py --baseline results.json --threshold 0.15
+
+With --baseline the run fails (exit 1) when the median wall time of a scenario is more
+than --threshold slower than in the baseline file.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from importlib.metadata import version
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from payloads import SCENARIOS, generate_payload  # noqa: E402
+
+
+def phase_sums(histogram):
+    # phase -> total seconds recorded so far
+    sums = {}
+    for labels, series in histogram.series.items():
+        sums[dict(labels)['phase']] = series[-1]
+    return sums
+
+
+def run_scenario(name, repeat, query=''):
+    # Runs inside the child process
+    import app as report_app
+    from report_metrics import PHASE_SECONDS, peak_rss_bytes
+
+    report_app.app.config['REPORT_CACHE_ENABLED'] = False
+    report_app.app.config['METRICS_SAMPLE_RATE'] = 1.0
+    client = report_app.app.test_client()
+    body = json.dumps(generate_payload(**SCENARIOS[name]))
+
+    # Warm-up request, not measured
+    client.post('/process_summary_comparison' + query, data=body, content_type='application/json').get_data()
+
+    wall = []
+    size = None
+    before = phase_sums(PHASE_SECONDS)
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.post('/process_summary_comparison' + query, data=body, content_type='application/json')
+        data = response.get_data()
+        wall.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise SystemExit(f"{name}: HTTP {response.status_code}: {data[:200]!r}")
+        size = len(data)
+    after = phase_sums(PHASE_SECONDS)
+
+    return {
+        'payload_bytes': len(body),
+        'output_bytes': size,
+        'wall_seconds': {
+            'median': statistics.median(wall),
+            'min': min(wall),
+            'max': max(wall),
+        },
+        'phase_seconds': {phase: (after[phase] - before.get(phase, 0.0)) / repeat for phase in sorted(after)},
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def run_isolated(name, repeat, query=''):
+    child = subprocess.run(
+        [sys.executable, __file__, '--child', name, '--repeat', str(repeat), '--query', query],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if child.returncode != 0:
+        raise SystemExit(f"scenario {name} failed:\n{child.stderr}")
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        now, before = result['wall_seconds']['median'], base['wall_seconds']['median']
+        change = (now - before) / before if before else 0.0
+        flag = 'REGRESSION' if change > threshold else 'ok'
+        print(f"{name:>10}: {before * 1000:8.1f} ms -> {now * 1000:8.1f} ms ({change:+.1%}) {flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--query', default='', help="query string for every request, e.g. '?stream=1'")
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='allowed slowdown of the median wall time (0.15 = 15%%)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.repeat, args.query)))
+        return 0
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'flask': version('flask'),
+        'xlsxwriter': version('xlsxwriter'),
+        'query': args.query,
+        'repeat': args.repeat,
+        'scenarios': {},
+    }
+    for name in args.scenario or sorted(SCENARIOS):
+        result = run_isolated(name, args.repeat, args.query)
+        results['scenarios'][name] = result
+        print(f"{name:>10}: median {result['wall_seconds']['median'] * 1000:8.1f} ms, "
+              f"{result['output_bytes'] / 1024:8.1f} KiB, peak RSS {result['peak_rss_bytes'] / 2 ** 20:6.1f} MiB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
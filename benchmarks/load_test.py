@@ -0,0 +1,297 @@
+"""Load-test /process_summary_comparison behind gunicorn at several worker counts.
+
+For each --workers value a gunicorn server is started from gunicorn.conf.py (report
+cache off). Then for each --concurrency level that many clients post payloads drawn
+from the request --mix for --duration seconds. Every run reports throughput, latency
+percentiles (overall and per mix item), errors by status, and the server's RSS over
+time (Linux). With --slo-p99 the report names the highest concurrency each worker
+count sustained within the SLO:
+
+    python benchmarks/load_test.py --workers 1 2 4 --concurrency 8 --scenario medium
+    python benchmarks/load_test.py --workers 2 4 --concurrency 2 4 8 16 \\
+        --mix small:6 medium:3 large:1 'medium?sheets=consolidated:2' --slo-p99 2 --output load.json
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from payloads import SCENARIOS, generate_payload  # noqa: E402
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def latency_summary(latencies):
+    return {
+        'p50': statistics.median(latencies),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+    }
+
+
+def parse_mix(items):
+    # ["small:6", "medium?sheets=consolidated:2"] -> [(label, scenario, query, weight)]
+    mix = []
+    for item in items:
+        label, _, weight = item.rpartition(':')
+        if not label:
+            label, weight = weight, '1'
+        scenario, _, query = label.partition('?')
+        if scenario not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {scenario!r} in --mix (one of {', '.join(sorted(SCENARIOS))})")
+        mix.append((label, scenario, '?' + query if query else '', float(weight)))
+    return mix
+
+
+def process_tree_rss(root_pid):
+    # Resident bytes of root_pid and all its descendants (gunicorn master + workers and
+    # their pools), from /proc; None where /proc is not available
+    if not os.path.isdir('/proc'):
+        return None
+    parents = {}
+    rss = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # The command name may contain spaces; fields after it are fixed
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{name}/statm') as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents[int(name)] = int(fields[1])
+        rss[int(name)] = resident_pages * PAGE_SIZE
+    total = 0
+    for pid in rss:
+        ancestor = pid
+        while ancestor and ancestor != root_pid:
+            ancestor = parents.get(ancestor)
+        if ancestor == root_pid:
+            total += rss[pid]
+    return total
+
+
+def start_server(workers, threads, port, extra_env=None):
+    env = dict(
+        os.environ, WEB_WORKERS=str(workers), WEB_THREADS=str(threads), BIND=f'127.0.0.1:{port}',
+        WEB_ACCESS_LOG='', REPORT_CACHE_ENABLED='0',
+    )
+    env.update(extra_env or {})
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited:\n{server.stderr.read().decode()}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/readyz')
+            ready = conn.getresponse().status == 200
+            conn.close()
+            if ready:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise SystemExit("gunicorn did not become ready within 60 s")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def client_loop(port, path, requests, weights, seed, until, outcomes):
+    # outcomes gets (finished at, mix label, seconds, status or 'connection')
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    headers = {'Content-Type': 'application/json'}
+    while time.monotonic() < until:
+        label, query, body = rng.choices(requests, weights)[0]
+        started = time.perf_counter()
+        try:
+            conn.request('POST', path + query, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+            status = 'connection'
+        outcomes.append((time.monotonic(), label, time.perf_counter() - started, status))
+    conn.close()
+
+
+def sample_rss(server, interval, stop, samples, started):
+    while not stop.wait(interval):
+        rss = process_tree_rss(server.pid)
+        if rss is not None:
+            samples.append((time.monotonic() - started, rss))
+
+
+def run_load(server, port, path, requests, weights, concurrency, duration, sample_interval, seed=0):
+    outcomes, rss_samples = [], []
+    started_at = time.monotonic()
+    until = started_at + duration
+    started = time.perf_counter()
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_rss, args=(server, sample_interval, stop, rss_samples, started_at))
+    sampler.start()
+    clients = [
+        threading.Thread(target=client_loop, args=(port, path, requests, weights, seed + n, until, outcomes))
+        for n in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    latencies = [seconds for _, _, seconds, status in outcomes if status == 200]
+    errors = collections.Counter(str(status) for _, _, _, status in outcomes if status != 200)
+    result = {
+        'requests': len(latencies),
+        'errors': sum(errors.values()),
+        'error_rate': sum(errors.values()) / len(outcomes) if outcomes else 0.0,
+        'errors_by_status': dict(errors),
+        'rps': len(latencies) / elapsed,
+    }
+    if latencies:
+        result['latency_seconds'] = latency_summary(latencies)
+    by_label = collections.defaultdict(list)
+    for _, label, seconds, status in outcomes:
+        if status == 200:
+            by_label[label].append(seconds)
+    result['mix'] = {
+        label: dict(requests=len(values), latency_seconds=latency_summary(values))
+        for label, values in by_label.items()
+    }
+
+    # Completed requests and RSS per sample interval, for spotting warm-up, leaks and stalls
+    timeline = []
+    buckets = collections.Counter(int((finished - started_at) // sample_interval) for finished, *_ in outcomes)
+    for offset, rss in rss_samples:
+        bucket = int(offset // sample_interval) - 1
+        timeline.append({'t': round(offset, 2), 'rss_bytes': rss, 'completed': buckets.get(bucket, 0)})
+    result['timeline'] = timeline
+    if rss_samples:
+        result['rss_bytes'] = {'start': rss_samples[0][1], 'end': rss_samples[-1][1],
+                               'max': max(rss for _, rss in rss_samples)}
+    return result
+
+
+def meets_slo(result, slo_p99, slo_error_rate):
+    latency = result.get('latency_seconds')
+    return latency is not None and latency['p99'] <= slo_p99 and result['error_rate'] <= slo_error_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8],
+                        help='concurrent clients; several values run one after another per worker count')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per run')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='medium',
+                        help='payload for every request when --mix is not given')
+    parser.add_argument('--mix', nargs='+', metavar='SCENARIO[?QUERY][:WEIGHT]',
+                        help="weighted request mix, e.g. small:6 medium:3 'large?charts=0:1'")
+    parser.add_argument('--path', default='/process_summary_comparison')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--env', nargs='+', default=[], metavar='KEY=VALUE',
+                        help='extra server environment, e.g. ADMISSION_MAX_CONCURRENT=2')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='seconds between RSS samples')
+    parser.add_argument('--slo-p99', type=float, help='p99 latency objective in seconds')
+    parser.add_argument('--slo-error-rate', type=float, default=0.01, help='allowed share of failed requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix or [args.scenario])
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    bodies = {}
+    requests = []
+    for label, scenario, query, _ in mix:
+        if scenario not in bodies:
+            bodies[scenario] = json.dumps(generate_payload(**SCENARIOS[scenario])).encode('utf-8')
+        requests.append((label, query, bodies[scenario]))
+    weights = [weight for *_, weight in mix]
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpus': os.cpu_count(),
+        'mix': {label: weight for label, _, _, weight in mix},
+        'threads': args.threads,
+        'duration': args.duration,
+        'env': extra_env,
+        'runs': {},
+    }
+    if args.slo_p99 is not None:
+        results['slo'] = {'p99_seconds': args.slo_p99, 'error_rate': args.slo_error_rate, 'max_concurrency': {}}
+    for workers in args.workers:
+        server = start_server(workers, args.threads, args.port, extra_env)
+        try:
+            for concurrency in args.concurrency:
+                result = run_load(
+                    server, args.port, args.path, requests, weights, concurrency, args.duration,
+                    args.sample_interval, args.seed,
+                )
+                result.update(workers=workers, concurrency=concurrency)
+                results['runs'][f"{workers}x{concurrency}"] = result
+                latency = result.get('latency_seconds', {})
+                rss = result.get('rss_bytes', {})
+                line = (f"workers={workers:<3} clients={concurrency:<4} {result['rps']:8.2f} req/s  "
+                        f"p50 {latency.get('p50', 0) * 1000:8.1f} ms  p99 {latency.get('p99', 0) * 1000:8.1f} ms  "
+                        f"errors {result['errors']} ({result['error_rate']:.1%})  "
+                        f"rss max {rss.get('max', 0) / 2 ** 20:7.1f} MiB")
+                if args.slo_p99 is not None:
+                    result['meets_slo'] = meets_slo(result, args.slo_p99, args.slo_error_rate)
+                    line += '  SLO ok' if result['meets_slo'] else '  SLO missed'
+                print(line)
+        finally:
+            stop_server(server)
+
+    if args.slo_p99 is not None:
+        print(f"SLO p99 <= {args.slo_p99 * 1000:.0f} ms, errors <= {args.slo_error_rate:.1%}:")
+        for workers in args.workers:
+            passing = [run['concurrency'] for run in results['runs'].values()
+                       if run['workers'] == workers and run['meets_slo']]
+            best = max(passing) if passing else None
+            results['slo']['max_concurrency'][str(workers)] = best
+            print(f"  workers={workers:<3} " + (f"up to {best} concurrent clients" if best else "missed at every level"))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
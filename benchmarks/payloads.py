@@ -0,0 +1,116 @@
+import random
+
+# Synthetic /process_summary_comparison payloads shaped like the ones the dashboards send:
+# per-year summary / comparison / combined tables (combined split into SCOPE blocks with
+# German or English headers and GESAMT/TOTAL rows) plus the consolidated table.
+
+SCOPE_HEADERS = {
+    'de': {
+        1: "SCOPE 1 - Direkte Emissionen",
+        2: "SCOPE 2 - Indirekte Emissionen aus Energie",
+        3: "SCOPE 3 - Weitere indirekte Emissionen",
+    },
+    'en': {
+        1: "SCOPE 1 - Direct emissions",
+        2: "SCOPE 2 - Indirect emissions from energy",
+        3: "SCOPE 3 - Other indirect emissions",
+    },
+}
+TOTAL_LABEL = {'de': "GESAMT", 'en': "TOTAL"}
+
+CATEGORY_NAMES = {
+    1: ["Stationäre Verbrennung", "Mobile Verbrennung", "Prozessemissionen", "Flüchtige Emissionen"],
+    2: ["Eingekaufter Strom", "Fernwärme und -kälte"],
+    3: [
+        "Eingekaufte Waren", "Kapitalgüter", "Brennstoff- und energiebezogene Emissionen",
+        "Vorgelagerter Transport", "Abfall", "Geschäftsreisen", "Pendeln der Mitarbeitenden",
+        "Vorgelagerte geleaste Anlagen", "Nachgelagerter Transport", "Verarbeitung verkaufter Produkte",
+        "Nutzung verkaufter Produkte", "Entsorgung verkaufter Produkte", "Nachgelagerte geleaste Anlagen",
+        "Franchise", "Investitionen",
+    ],
+}
+
+
+def category_labels(scope, count, subcategories):
+    # [("1.1", "1.1 Stationäre Verbrennung"), ("1.1.1", "1.1.1 Position 1"), ...]
+    labels = []
+    for number in range(1, count + 1):
+        code = f"{scope}.{number}"
+        names = CATEGORY_NAMES[scope]
+        labels.append((code, f"{code} {names[(number - 1) % len(names)]}"))
+        for sub in range(1, subcategories + 1):
+            labels.append((f"{code}.{sub}", f"{code}.{sub} Position {sub}"))
+    return labels
+
+
+def scope_layout(scope3_categories, subcategories):
+    return {
+        1: category_labels(1, 4, subcategories),
+        2: category_labels(2, 2, subcategories),
+        3: category_labels(3, scope3_categories, subcategories),
+    }
+
+
+def generate_payload(years=5, scope3_categories=7, subcategories=1, language='de', first_year=2015,
+                     comparison_columns=3, with_consolidated=True, seed=0):
+    rng = random.Random(seed)
+    layout = scope_layout(scope3_categories, subcategories)
+    year_list = list(range(first_year, first_year + years))
+    values = {}  # (code, year) -> tCO2e, shared by the yearly and consolidated tables
+
+    entries = []
+    for year in year_list:
+        combined = [["Alle Scopes" if language == 'de' else "All scopes", "tCO₂e"]]
+        scope_totals = {}
+        for scope, labels in layout.items():
+            combined.append([SCOPE_HEADERS[language][scope], ""])
+            total = 0.0
+            for code, label in labels:
+                value = round(rng.uniform(0.5, 2500.0), 3)
+                values[code, year] = value
+                if code.count('.') == 1:
+                    total += value
+                combined.append([label, value])
+            combined.append([TOTAL_LABEL[language], round(total, 3)])
+            scope_totals[scope] = round(total, 3)
+        grand_total = sum(scope_totals.values())
+
+        summary = [
+            [f"Zusammenfassung {year}", "", ""],
+            ["Kategorie", "Emissionen (tCO2e)", "Anteil (%)"],
+        ]
+        for scope, total in scope_totals.items():
+            summary.append([f"Scope {scope}", total, round(100 * total / grand_total, 2)])
+        summary.append([TOTAL_LABEL[language].capitalize(), round(grand_total, 3), 100])
+
+        comparison = [[f"Vergleich {year}"] + [""] * comparison_columns]
+        comparison.append(["Kategorie"] + [year - comparison_columns + 1 + i for i in range(comparison_columns)])
+        for scope in layout:
+            comparison.append([f"Scope {scope}"] + [round(rng.uniform(100, 5000), 2) for _ in range(comparison_columns)])
+        comparison.append([TOTAL_LABEL[language].capitalize()] + [round(rng.uniform(1000, 15000), 2)
+                                                                   for _ in range(comparison_columns)])
+
+        entries.append({'year': year, 'summary': summary, 'comparison': comparison, 'combined': combined})
+
+    payload = {'data': entries}
+    if with_consolidated:
+        consolidated = [["Kategorie"] + year_list]
+        for scope, labels in layout.items():
+            top = [code for code, _ in labels if code.count('.') == 1]
+            consolidated.append([SCOPE_HEADERS[language][scope]] + [
+                round(sum(values[code, year] for code in top), 3) for year in year_list
+            ])
+            for code, label in labels:
+                if code.count('.') == 1:
+                    consolidated.append([label] + [values[code, year] for year in year_list])
+        payload['consolidated'] = consolidated
+    return payload
+
+
+# Named shapes used by the benchmark and load-test harnesses
+SCENARIOS = {
+    'small': {'years': 2, 'scope3_categories': 7, 'subcategories': 0},
+    'medium': {'years': 10, 'scope3_categories': 7, 'subcategories': 2},
+    'large': {'years': 30, 'scope3_categories': 15, 'subcategories': 5},
+    'english': {'years': 10, 'scope3_categories': 7, 'subcategories': 2, 'language': 'en'},
+}
@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+# Gunicorn settings, all overridable from the environment. Report builds are CPU bound
+# and hold the GIL, so throughput scales with worker processes; a couple of threads per
+# worker keep slow uploads/downloads and cache hits from queueing behind a build.
+#
+# Each worker has its own report cache, metrics registry and batch/job process pools,
+# so size BATCH_WORKERS and JOBS_WORKERS with WEB_WORKERS in mind.
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+workers = int(os.environ.get('WEB_WORKERS', 0)) or multiprocessing.cpu_count()
+threads = int(os.environ.get('WEB_THREADS', 2))
+worker_class = 'gthread'
+preload_app = True
+
+# Large reports take a while; the worker timeout must stay above the slowest build
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+# Recycle workers now and then to cap fragmentation of long-lived processes (0 = never)
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Request bodies are capped by MAX_CONTENT_LENGTH in the app; these only bound headers
+limit_request_line = 8190
+limit_request_field_size = 8190
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    # Runs in the worker after it stopped accepting requests (SIGTERM / max_requests)
+    from app import shutdown
+    shutdown()
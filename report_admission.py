@@ -0,0 +1,148 @@
+import collections
+import math
+import threading
+import time
+
+from report_metrics import REGISTRY
+from report_template import CONSOLIDATED_CHARTS, FULL_REPORT, YEAR_SCOPE_PIES
+
+# Admission control for report builds in one server process. Every build is charged an
+# estimated memory cost; builds run while the admitted cost stays within the memory
+# budget and fewer than max_concurrent are running, the rest wait in FIFO order. A full
+# queue is answered with 429, a request that waited queue_timeout seconds with 503, both
+# with a Retry-After. Budgets are per process: with several gunicorn workers divide the
+# pod's memory by WEB_WORKERS.
+
+# Cost model, fitted on tracemalloc peaks of render_report_bytes() over the benchmark
+# payloads (2..60 years, up to 40 subcategories) and rounded up
+BASE_BYTES = 1024 * 1024
+BYTES_PER_CELL = 640
+BYTES_PER_CHART = 32 * 1024
+CHARTS_PER_YEAR = 1 + len(YEAR_SCOPE_PIES)
+
+BUILD_SECONDS_ALPHA = 0.2  # weight of the newest build in the moving average
+
+WAIT_SECONDS = REGISTRY.histogram('report_admission_wait_seconds', 'Time report builds waited for admission.')
+
+
+def table_cells(table):
+    return sum(len(row) for row in table)
+
+
+def estimate_cost(entries, consolidated_data, selection=FULL_REPORT):
+    # Estimated peak memory (bytes) of building one workbook (the selected sheets of it)
+    # from this payload
+    cells = 0
+    charts = 0
+    selected = selection.entries(entries)
+    for entry in selected:
+        cells += table_cells(entry['summary']) + table_cells(entry['comparison']) + table_cells(entry['combined'])
+    if selection.consolidated:
+        if consolidated_data is not None:
+            cells += table_cells(consolidated_data)
+        elif entries:
+            # Derived on the server: about one row per combined row, one column per year
+            cells += len(entries[-1]['combined']) * (len(entries) + 1)
+        charts += len(CONSOLIDATED_CHARTS)
+    if selection.charts:
+        charts += CHARTS_PER_YEAR * len(selected)
+    else:
+        charts = 0
+    return BASE_BYTES + cells * BYTES_PER_CELL + charts * BYTES_PER_CHART
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class Admission:
+
+    def __init__(self, memory_budget, max_concurrent=None, max_queued=None, queue_timeout=None):
+        self.memory_budget = memory_budget
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.in_flight = 0
+        self.admitted_bytes = 0
+        self.build_seconds = None
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected_full': 0, 'rejected_timeout': 0}
+
+    def fits(self, cost):
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            return False
+        # A build larger than the whole budget runs alone rather than never
+        return self.in_flight == 0 or self.admitted_bytes + cost <= self.memory_budget
+
+    def retry_after(self):
+        # Seconds until the current queue should have drained, from recent build times
+        average = self.build_seconds or 1.0
+        ahead = len(self.queue) + self.in_flight
+        return max(1, math.ceil(average * ahead / (self.max_concurrent or 1)))
+
+    def acquire(self, cost):
+        # Blocks until the build may start; returns the seconds spent waiting
+        started = time.perf_counter()
+        with self.cond:
+            if not self.queue and self.fits(cost):
+                self._admit(cost)
+                return self._waited(started)
+            if self.max_queued is not None and len(self.queue) >= self.max_queued:
+                self.stats['rejected_full'] += 1
+                raise AdmissionRejected(429, "too many report builds queued, try again later", self.retry_after())
+            ticket = object()
+            self.queue.append(ticket)
+            self.stats['queued'] += 1
+            deadline = started + self.queue_timeout if self.queue_timeout else None
+            try:
+                while not (self.queue[0] is ticket and self.fits(cost)):
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        self.stats['rejected_timeout'] += 1
+                        raise AdmissionRejected(503, "timed out waiting for report capacity", self.retry_after())
+                    self.cond.wait(remaining)
+            finally:
+                self.queue.remove(ticket)
+                # The next request in line may fit now (or may be first now)
+                self.cond.notify_all()
+            self._admit(cost)
+        return self._waited(started)
+
+    def _waited(self, started):
+        waited = time.perf_counter() - started
+        with REGISTRY.lock:
+            WAIT_SECONDS.observe(waited)
+        return waited
+
+    def _admit(self, cost):
+        self.in_flight += 1
+        self.admitted_bytes += cost
+        self.stats['admitted'] += 1
+
+    def release(self, cost, seconds):
+        with self.cond:
+            self.in_flight -= 1
+            self.admitted_bytes -= cost
+            if self.build_seconds is None:
+                self.build_seconds = seconds
+            else:
+                self.build_seconds += BUILD_SECONDS_ALPHA * (seconds - self.build_seconds)
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            return dict(
+                self.stats,
+                in_flight=self.in_flight,
+                admitted_bytes=self.admitted_bytes,
+                queue_depth=len(self.queue),
+                memory_budget=self.memory_budget,
+                max_concurrent=self.max_concurrent,
+                build_seconds=self.build_seconds,
+            )
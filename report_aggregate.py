@@ -0,0 +1,91 @@
+import math
+
+from report_columns import NUMBER_TYPES
+from report_index import CategoryIndex, parse_code
+
+# Server-side "Consolidated Totals": per-category and per-scope values across years,
+# derived from the SCOPE blocks of each entry's combined table. Categories are matched
+# across years by their code ("1.1", "3.4"), so renamed labels and categories missing in
+# some years line up; only top-level categories are consolidated, as in the client table.
+CONSOLIDATED_HEADER = "Category"
+
+
+def code_key(code):
+    # "3.10" sorts after "3.9"
+    return tuple(int(part) for part in code.split('.'))
+
+
+def column_sums(columns):
+    # [[addends of year 1], ...] -> [sum or None]; fsum rounds once, so the result does not
+    # depend on the order categories were added in
+    return [math.fsum(addends) if addends else None for addends in columns]
+
+
+def year_over_year(values):
+    # [(delta, relative delta) or None for the first year / missing values]
+    changes = [None]
+    for before, now in zip(values, values[1:]):
+        if before is None or now is None:
+            changes.append(None)
+        else:
+            changes.append((now - before, (now - before) / before if before else None))
+    return changes
+
+
+class ConsolidatedTotals:
+    #   years    sheet years in entry order
+    #   scopes   [{'scope', 'label', 'values', 'categories': [{'code', 'label', 'values'}]}]
+    #            'values' has one item per year, None where a year has no number
+
+    def __init__(self, years, scopes):
+        self.years = years
+        self.scopes = scopes
+
+    def table(self, header=CONSOLIDATED_HEADER):
+        # The consolidated table in the client format: header row of years, then per scope
+        # its subtotal row ("SCOPE n ...") followed by one row per category
+        rows = [[header] + self.years]
+        for scope in self.scopes:
+            rows.append([scope['label']] + scope['values'])
+            for category in scope['categories']:
+                rows.append([category['label']] + category['values'])
+        return rows
+
+
+def aggregate_entries(entries):
+    years = [entry['year'] for entry in entries]
+    scopes = {}
+    for col_idx, entry in enumerate(entries):
+        combined = entry['combined']
+        index = CategoryIndex(combined)
+        for scope_num, (start, end) in index.blocks.items():
+            scope = scopes.get(scope_num)
+            if scope is None:
+                scope = scopes[scope_num] = {'scope': scope_num, 'categories': {}}
+            # Latest year wins for labels; the block header is the row above its start
+            scope['label'] = combined[start - 1][0]
+            for row in combined[start:end]:
+                code = parse_code(row[0]) if row and isinstance(row[0], str) else None
+                if code is None or code.count('.') != 1:
+                    continue
+                category = scope['categories'].get(code)
+                if category is None:
+                    category = scope['categories'][code] = {'code': code, 'addends': [[] for _ in years]}
+                category['label'] = row[0]
+                if len(row) > 1 and isinstance(row[1], NUMBER_TYPES):
+                    category['addends'][col_idx].append(row[1])
+
+    result = []
+    for scope_num in sorted(scopes):
+        scope = scopes[scope_num]
+        categories = []
+        scope_addends = [[] for _ in years]
+        for code in sorted(scope['categories'], key=code_key):
+            category = scope['categories'][code]
+            for col_idx, addends in enumerate(category['addends']):
+                scope_addends[col_idx].extend(addends)
+            categories.append({'code': code, 'label': category['label'], 'values': column_sums(category['addends'])})
+        result.append({
+            'scope': scope_num, 'label': scope['label'], 'values': column_sums(scope_addends), 'categories': categories,
+        })
+    return ConsolidatedTotals(years, result)
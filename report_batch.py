@@ -0,0 +1,160 @@
+import json
+import multiprocessing
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from report_ingest import PayloadError, validate_payload
+from report_template import render_report_bytes
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor(max_workers):
+    # One process pool per server process, created on first use. Workers are spawned
+    # rather than forked so they never inherit the server's threads or locks.
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+            )
+        return executor
+
+
+def discard_executor(broken):
+    # A worker died (OOM kill, segfault); the next batch gets a fresh pool
+    global executor
+    with executor_lock:
+        if executor is broken:
+            executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executor():
+    # Waits for running builds; batches still queued on the pool are cancelled
+    global executor
+    with executor_lock:
+        pool, executor = executor, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def build_report(entries, consolidated_data, compression=None):
+    # Runs in a worker process. Errors come back as text so they always pickle.
+    started = time.perf_counter()
+    try:
+        body = render_report_bytes(entries, consolidated_data, compression=compression)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}", time.perf_counter() - started
+    return body, None, time.perf_counter() - started
+
+
+def report_filenames(reports):
+    # "ACME GmbH" -> "ACME_GmbH.xlsx", made unique within the batch
+    names = []
+    seen = set()
+    for idx, report in enumerate(reports):
+        name = report.get('name') if isinstance(report, dict) else None
+        base = re.sub(r'[^\w.-]+', '_', str(name)).strip('._') if name else ''
+        base = base or f"report_{idx + 1}"
+        filename = f"{base}.xlsx"
+        suffix = 2
+        while filename in seen:
+            filename = f"{base}_{suffix}.xlsx"
+            suffix += 1
+        seen.add(filename)
+        names.append(filename)
+    return names
+
+
+class ChunkBuffer:
+    # Write-only sink for ZipFile; the zip is streamed as whatever has been written
+    # since the last drain()
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(results, manifest_name='manifest.json', manifest_key='reports', compress_type=zipfile.ZIP_STORED):
+    # results yields (index, filename, body, manifest_entry) as reports finish. Workbooks
+    # are already deflated, so by default members are stored as-is; the manifest (one
+    # entry per member, in request order) is appended last.
+    buffer = ChunkBuffer()
+    manifest = []
+    timestamp = time.localtime()[:6]
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for index, filename, body, entry in results:
+            if body is not None:
+                info = zipfile.ZipInfo(filename, timestamp)
+                info.compress_type = compress_type
+                archive.writestr(info, body)
+            manifest.append((index, entry))
+            yield buffer.drain()
+        manifest = [entry for _, entry in sorted(manifest, key=lambda item: item[0])]
+        info = zipfile.ZipInfo(manifest_name, timestamp)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, json.dumps({manifest_key: manifest}, indent=2))
+    yield buffer.drain()
+
+
+def run_batch(reports, max_workers, cache=None, key_for=None, limits=None, compression=None):
+    # Fan the reports out over the process pool and yield them in completion order.
+    # Invalid items and failed builds only produce an error entry in the manifest.
+    filenames = report_filenames(reports)
+    pool = get_executor(max_workers)
+    futures = {}
+    ready = []
+    for idx, (report, filename) in enumerate(zip(reports, filenames)):
+        entry = {'name': report.get('name') if isinstance(report, dict) else None, 'file': filename}
+        try:
+            entries, consolidated_data = validate_payload(report, **(limits or {}))
+        except PayloadError as e:
+            ready.append((idx, filename, None, dict(entry, status='error', error=e.message)))
+            continue
+        key = key_for(entries, consolidated_data, compression) if cache is not None else None
+        cached = cache.get(key) if key is not None else None
+        if cached is not None:
+            ready.append((idx, filename, cached, dict(entry, status='ok', bytes=len(cached), cached=True)))
+            continue
+        try:
+            future = pool.submit(build_report, entries, consolidated_data, compression)
+        except BrokenProcessPool:
+            discard_executor(pool)
+            pool = get_executor(max_workers)
+            future = pool.submit(build_report, entries, consolidated_data, compression)
+        futures[future] = (idx, filename, entry, key)
+
+    def results():
+        yield from ready
+        for future in as_completed(futures):
+            idx, filename, entry, key = futures[future]
+            try:
+                body, error, seconds = future.result()
+            except BrokenProcessPool as e:
+                discard_executor(pool)
+                body, error, seconds = None, f"BrokenProcessPool: {e}", 0.0
+            if error is not None:
+                yield idx, filename, None, dict(entry, status='error', error=error)
+                continue
+            if cache is not None:
+                cache.put(key, body, seconds)
+            yield idx, filename, body, dict(entry, status='ok', bytes=len(body), seconds=round(seconds, 3))
+
+    return stream_zip(results())
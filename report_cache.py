@@ -0,0 +1,241 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: processes sharing a directory are not serialized there
+    fcntl = None
+
+# Bump when the report layout changes so stale workbooks are not served from disk
+CACHE_KEY_VERSION = 2
+
+# Build times remembered per process for the saved_seconds stat of disk hits
+BUILD_SECONDS_MEMORY = 4096
+
+
+def payload_key(entries, consolidated_data, *extra):
+    # Hash of the canonical JSON payload (sorted keys, no whitespace) so that equivalent
+    # requests map to the same key regardless of how the client serialized them
+    canonical = json.dumps(
+        [CACHE_KEY_VERSION, entries, consolidated_data, extra],
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ReportCache:
+    # Size-bounded LRU of finished files keyed by payload hash, with optional TTL.
+    #
+    # In memory (per process) by default. With `directory` the entries are <key><suffix>
+    # files and the directory itself is the index, so every process sharing it (gunicorn
+    # workers) sees the same entries and the bounds hold for the directory as a whole:
+    # mtime is the store time (TTL), atime is set on every hit (LRU order), and eviction
+    # runs under a lock file.
+
+    def __init__(self, max_bytes, max_entries=None, ttl=None, directory=None, suffix='.xlsx'):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.suffix = suffix
+        self.current_bytes = 0
+        self.stats = {
+            'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0,
+            'saved_seconds': 0.0,
+        }
+        # Memory backend: key -> [size, stored_at, build_seconds, data]
+        self._entries = OrderedDict()
+        # Disk backend: key -> build seconds of the files this process stored
+        self._build_seconds = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    @contextlib.contextmanager
+    def _directory_lock(self):
+        # Serializes eviction between threads and, with fcntl, between processes
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _files(self):
+        # [(last used, stored, size, key)] of the entries in the directory
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append((st.st_atime, st.st_mtime, st.st_size, name[:-len(self.suffix)]))
+        return files
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict_files(self):
+        with self._directory_lock():
+            files = sorted(self._files())
+            now = time.time()
+            total = 0
+            kept = []
+            for used, stored, size, key in files:
+                if self.ttl and now - stored > self.ttl:
+                    self._remove_file(key)
+                    self.stats['expirations'] += 1
+                else:
+                    kept.append((size, key))
+                    total += size
+            # Least recently used first
+            count = len(kept)
+            for size, key in kept:
+                if total <= self.max_bytes and not (self.max_entries and count > self.max_entries):
+                    break
+                self._remove_file(key)
+                total -= size
+                count -= 1
+                self.stats['evictions'] += 1
+
+    def _drop(self, key):
+        size = self._entries.pop(key)[0]
+        self.current_bytes -= size
+
+    def _evict(self):
+        while self._entries and (
+            self.current_bytes > self.max_bytes
+            or (self.max_entries and len(self._entries) > self.max_entries)
+        ):
+            self._drop(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+
+    def get(self, key):
+        if self.directory:
+            return self._get_file(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:
+                self._drop(key)
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            self.stats['saved_seconds'] += entry[2]
+            return entry[3]
+
+    def _get_file(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored = os.fstat(f.fileno()).st_mtime
+                data = None if self.ttl and time.time() - stored > self.ttl else f.read()
+            if data is not None:
+                # Mark as recently used for the LRU; keeps mtime (the store time)
+                os.utime(path, (time.time(), stored))
+        except FileNotFoundError:
+            # Never stored, or evicted by a process sharing the directory
+            data = None
+        with self._lock:
+            if data is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.stats['saved_seconds'] += self._build_seconds.get(key, 0.0)
+        return data
+
+    def put(self, key, data, build_seconds=0.0):
+        if len(data) > self.max_bytes:
+            return
+        if self.directory:
+            # Write next to the final path and rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._store_file(key, build_seconds, tmp_path)
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = [len(data), time.time(), build_seconds, data]
+            self.current_bytes += len(data)
+            self.stats['stores'] += 1
+            self._evict()
+
+    def put_many(self, items):
+        # [(key, data)]; with the disk backend the directory is scanned once for all of them
+        if not self.directory:
+            for key, data in items:
+                self.put(key, data)
+            return
+        stored = False
+        for key, data in items:
+            if len(data) > self.max_bytes:
+                continue
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._store_file(key, 0.0, tmp_path, evict=False)
+            stored = True
+        if stored:
+            self._evict_files()
+
+    def put_file(self, key, path, build_seconds=0.0):
+        # Store a workbook that was spooled to disk. Only the disk backend takes it: the
+        # memory backend would have to read the whole file back into RAM, which is what
+        # spooling avoided in the first place.
+        if not self.directory or os.path.getsize(path) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(path, tmp_path)
+        self._store_file(key, build_seconds, tmp_path)
+
+    def _store_file(self, key, build_seconds, tmp_path, evict=True):
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._build_seconds[key] = build_seconds
+            self._build_seconds.move_to_end(key)
+            while len(self._build_seconds) > BUILD_SECONDS_MEMORY:
+                self._build_seconds.popitem(last=False)
+            self.stats['stores'] += 1
+        if evict:
+            self._evict_files()
+
+    def snapshot(self):
+        if self.directory:
+            files = self._files()
+            entries, current_bytes = len(files), sum(size for _, _, size, _ in files)
+        with self._lock:
+            if not self.directory:
+                entries, current_bytes = len(self._entries), self.current_bytes
+            return dict(
+                self.stats,
+                entries=entries,
+                bytes=current_bytes,
+                max_bytes=self.max_bytes,
+                backend='disk' if self.directory else 'memory',
+                pid=os.getpid(),
+            )
@@ -0,0 +1,45 @@
+from itertools import zip_longest
+
+NUMBER_TYPES = (int, float)
+
+
+def column_widths(*tables):
+    # Max display width (len(str(cell)) + 2) per column over all tables, computed column
+    # by column on the transposed tables instead of concatenating them row by row
+    widths = []
+    for table in tables:
+        for col_idx, column in enumerate(zip_longest(*table, fillvalue='')):
+            width = max(map(len, map(str, column))) + 2
+            if col_idx < len(widths):
+                widths[col_idx] = max(widths[col_idx], width)
+            else:
+                widths.append(width)
+    return widths
+
+
+def scale_numbers(rows, scale):
+    # Copy of rows with every numeric cell multiplied by scale (e.g. kg -> t)
+    return [
+        [cell * scale if isinstance(cell, NUMBER_TYPES) else cell for cell in row]
+        for row in rows
+    ]
+
+
+def write_typed_row(worksheet, row_num, row, number_format, text_format, first_format=None):
+    # Emit a data row as runs of consecutive numbers (number_format) and non-numbers
+    # (text_format), one write_row per run; the first column gets first_format if given
+    start = 0
+    end = len(row)
+    if first_format is not None and end:
+        worksheet.write(row_num, 0, row[0], first_format)
+        start = 1
+    while start < end:
+        numeric = isinstance(row[start], NUMBER_TYPES)
+        stop = start + 1
+        while stop < end and isinstance(row[stop], NUMBER_TYPES) is numeric:
+            stop += 1
+        if stop - start == 1:
+            worksheet.write(row_num, start, row[start], number_format if numeric else text_format)
+        else:
+            worksheet.write_row(row_num, start, row[start:stop], number_format if numeric else text_format)
+        start = stop
@@ -0,0 +1,51 @@
+import contextlib
+import contextvars
+import zipfile
+
+import xlsxwriter.workbook
+
+# ZIP compression profiles for the generated XLSX packages. XlsxWriter always deflates at
+# zlib's default level, so its ZipFile is replaced by one that takes the compression of
+# the profile active in the current context. Outside compression_profile() it behaves
+# exactly like zipfile.ZipFile.
+COMPRESSION_PROFILES = {
+    'store': (zipfile.ZIP_STORED, None),     # no deflate at all; largest files, cheapest close
+    'fastest': (zipfile.ZIP_DEFLATED, 1),
+    'balanced': (zipfile.ZIP_DEFLATED, None),  # zlib default (level 6), what XlsxWriter does
+    'smallest': (zipfile.ZIP_DEFLATED, 9),
+}
+DEFAULT_PROFILE = 'balanced'
+
+active_profile = contextvars.ContextVar('report_compression_profile', default=None)
+
+
+class ProfileZipFile(zipfile.ZipFile):
+
+    def __init__(self, file, mode='r', compression=zipfile.ZIP_STORED, allowZip64=True, compresslevel=None,
+                 **kwargs):
+        profile = active_profile.get()
+        if profile is not None and 'w' in mode:
+            compression, compresslevel = COMPRESSION_PROFILES[profile]
+        super().__init__(file, mode, compression, allowZip64, compresslevel, **kwargs)
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        # In in_memory mode XlsxWriter passes a ZipInfo with the archive's compress_type
+        # but no level, so the archive level has to be applied here
+        if compresslevel is None and isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            compresslevel = self.compresslevel
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+
+
+xlsxwriter.workbook.ZipFile = ProfileZipFile
+
+
+@contextlib.contextmanager
+def compression_profile(name):
+    # Workbooks closed inside the block use the named profile (None: XlsxWriter default)
+    if name is not None and name not in COMPRESSION_PROFILES:
+        raise ValueError(f"unknown compression profile {name!r}")
+    token = active_profile.set(name)
+    try:
+        yield
+    finally:
+        active_profile.reset(token)
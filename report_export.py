@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+import zipfile
+
+from report_aggregate import year_over_year
+from report_batch import stream_zip
+from report_columns import NUMBER_TYPES
+from report_index import CategoryIndex, parse_code
+from report_template import FULL_REPORT, REPORT_TEMPLATE
+
+# Lighter alternatives to the XLSX report for consumers that only need the numbers. Both
+# walk the tables in the order ReportTemplate.render() writes them and build no charts.
+#
+#   csv    ZIP with one CSV per table ("Consolidated Totals/consolidated.csv",
+#          "Year 2020/summary.csv", ...) plus manifest.json, streamed table by table
+#   json   the same tables plus per-scope breakdowns of every combined table
+EXPORT_FORMATS = {
+    'csv': {
+        'accept': ('text/csv', 'application/zip'),
+        'mimetype': 'application/zip',
+        'filename': 'Summary_Comparison_Report.zip',
+    },
+    'json': {
+        'accept': ('application/json',),
+        'mimetype': 'application/json',
+        'filename': 'Summary_Comparison_Report.json',
+    },
+}
+
+
+def table_csv(rows):
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\r\n').writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def stream_csv_bundle(entries, consolidated_data, template=REPORT_TEMPLATE, selection=FULL_REPORT):
+    def results():
+        for index, (sheet, table, rows) in enumerate(template.tables(entries, consolidated_data, selection)):
+            filename = f"{sheet}/{table}.csv"
+            entry = {'file': filename, 'sheet': sheet, 'table': table, 'rows': len(rows)}
+            yield index, filename, table_csv(rows), entry
+
+    return stream_zip(results(), manifest_key='tables', compress_type=zipfile.ZIP_DEFLATED)
+
+
+def cell_number(row, col_idx):
+    if len(row) > col_idx and isinstance(row[col_idx], NUMBER_TYPES):
+        return row[col_idx]
+    return None
+
+
+def scope_breakdown(rows, index):
+    # Per SCOPE block of a combined table: the block total (its GESAMT/TOTAL row, or the
+    # sum of its categories when that has no number) and each category with its share
+    scopes = []
+    for scope_num in sorted(index.blocks):
+        start, end = index.blocks[scope_num]
+        categories = []
+        for row in rows[start:end]:
+            code = parse_code(row[0]) if row and isinstance(row[0], str) else None
+            if code is None:
+                continue
+            item = {'code': code, 'label': row[0], 'value': cell_number(row, 1)}
+            if code.count('.') == 1:
+                categories.append(dict(item, subcategories=[]))
+            elif categories and code.startswith(categories[-1]['code'] + '.'):
+                categories[-1]['subcategories'].append(item)
+        total = cell_number(rows[end], 1)
+        if total is None:
+            total = sum(item['value'] for item in categories if item['value'] is not None)
+        for item in categories:
+            item['share'] = item['value'] / total if total and item['value'] is not None else None
+        scopes.append({'scope': scope_num, 'total': total, 'categories': categories})
+    return scopes
+
+
+def consolidated_scopes(consolidated_data):
+    # SCOPE rows of the consolidated table as {year: value}, with the year-over-year
+    # change as {year: {'delta', 'relative'}} from the second year on
+    if not consolidated_data:
+        return []
+    years = [str(year) for year in consolidated_data[0][1:]]
+    index = CategoryIndex(consolidated_data)
+    scopes = []
+    for scope_num in sorted(index.scope_rows):
+        row = consolidated_data[index.scope_rows[scope_num][0]]
+        values = [value if isinstance(value, NUMBER_TYPES) else None for value in row[1:len(years) + 1]]
+        deltas = {
+            year: {'delta': change[0], 'relative': change[1]}
+            for year, change in zip(years, year_over_year(values)) if change is not None
+        }
+        scopes.append({'scope': scope_num, 'label': row[0], 'values': dict(zip(years, row[1:])), 'deltas': deltas})
+    return scopes
+
+
+def render_json(entries, consolidated_data=None, template=REPORT_TEMPLATE, selection=FULL_REPORT):
+    # Charts are not part of the export, so only the sheet choice of the selection applies
+    years = []
+    for entry in selection.entries(entries):
+        item = {'year': entry['year']}
+        for step in template.year_layout:
+            item[step['table']] = entry[step['table']]
+        item['scopes'] = scope_breakdown(entry['combined'], template.year_plan(entry).index)
+        years.append(item)
+    report = {'years': years}
+    if selection.consolidated:
+        if consolidated_data is None:
+            consolidated_data = template.consolidate(entries).table()
+        report['consolidated'] = {'table': consolidated_data, 'scopes': consolidated_scopes(consolidated_data)}
+    return json.dumps(report, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
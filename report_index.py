@@ -0,0 +1,88 @@
+import re
+
+# "1.1 Stationäre Verbrennung", "3.7 Abfall", "1.1.1 Erdgas"
+CATEGORY_CODE = re.compile(r'(\d+(?:\.\d+)+) ')
+# "SCOPE 1 - Direkte Emissionen", "SCOPE 2 - Indirect emissions"
+SCOPE_LABEL = re.compile(r'SCOPE (\d+)')
+
+# Header rows that open each SCOPE block of a combined table (German and English)
+SCOPE_HEADERS = {
+    1: ("SCOPE 1 - Direkte Emissionen", "SCOPE 1 - Direct emissions"),
+    2: ("SCOPE 2",),
+    3: ("SCOPE 3",),
+}
+# Total rows that close a SCOPE block
+BLOCK_TERMINATORS = ("GESAMT", "TOTAL")
+
+
+def parse_code(label):
+    # "1.1 Stationäre Verbrennung" -> "1.1", anything without a leading code -> None
+    match = CATEGORY_CODE.match(label)
+    return match.group(1) if match else None
+
+
+def top_category(code):
+    # "1.1.2" -> "1.1"
+    return '.'.join(code.split('.', 2)[:2])
+
+
+class CategoryIndex:
+    # Classifies every row of a table once by its first column and maps scopes and
+    # category codes to row numbers, so chart builders never rescan the table.
+    #
+    #   codes        "1.1" -> rows labelled "1.1 ...", "1.1.1" -> rows labelled "1.1.1 ..."
+    #   subcodes     "1.1" -> rows of its subcategories ("1.1.1 ...", "1.1.2 ...")
+    #   scope_rows   1 -> rows starting with "SCOPE 1"
+    #   blocks       1 -> (first row after the SCOPE 1 header, its GESAMT/TOTAL row)
+
+    def __init__(self, rows, headers=SCOPE_HEADERS, terminators=BLOCK_TERMINATORS):
+        self.codes = {}
+        self.subcodes = {}
+        self.scope_rows = {}
+        self.blocks = {}
+
+        # Block detection follows the combined-table convention: a block opens on the
+        # last header seen before the first total row after it
+        block_start = {}
+        for row_idx, row in enumerate(rows):
+            label = row[0] if row and isinstance(row[0], str) else ''
+
+            code = parse_code(label)
+            if code is not None:
+                self.codes.setdefault(code, []).append(row_idx)
+                if code.count('.') > 1:
+                    self.subcodes.setdefault(top_category(code), []).append(row_idx)
+
+            scope = SCOPE_LABEL.match(label)
+            if scope:
+                self.scope_rows.setdefault(int(scope.group(1)), []).append(row_idx)
+
+            is_total = any(term in label for term in terminators)
+            for scope_num, scope_headers in headers.items():
+                if scope_num in self.blocks:
+                    continue
+                if any(header in label for header in scope_headers):
+                    block_start[scope_num] = row_idx + 1
+                if is_total and scope_num in block_start:
+                    self.blocks[scope_num] = (block_start[scope_num], row_idx)
+
+    def category_rows(self, categories, subcategories=False, block=None):
+        # Rows for the given category codes in table order, optionally with their
+        # subcategories and restricted to one SCOPE block
+        found = []
+        for code in categories:
+            found.extend(self.codes.get(code, ()))
+            if subcategories:
+                found.extend(self.subcodes.get(code, ()))
+        if block is not None:
+            if block not in self.blocks:
+                return []
+            start, end = self.blocks[block]
+            found = [row_idx for row_idx in found if start <= row_idx < end]
+        return sorted(found)
+
+    def scope_total_rows(self, scopes):
+        found = []
+        for scope_num in scopes:
+            found.extend(self.scope_rows.get(scope_num, ()))
+        return sorted(found)
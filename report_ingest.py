@@ -0,0 +1,125 @@
+import json
+import re
+import sys
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import orjson
+except ImportError:  # Optional, falls back to the stdlib decoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional, application/msgpack bodies are rejected without it
+    msgpack = None
+
+JSON_MIMETYPES = ('application/json',)
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+SCALAR_TYPES = (str, int, float, bool, type(None))
+YEAR_TABLES = ('summary', 'comparison', 'combined')
+# "Year Chart {year}" must stay a valid sheet name (31 chars, no []:*?/\)
+SHEET_NAME_LIMIT = 31 - len("Year Chart ")
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+class PayloadError(Exception):
+    # Raised before any workbook work starts; carries the HTTP status to answer with
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def decode_body(request, max_bytes=None):
+    # JSON (orjson when installed) or MessagePack body -> Python objects
+    if max_bytes and request.content_length is not None and request.content_length > max_bytes:
+        raise PayloadError(413, f"request body exceeds {max_bytes} bytes")
+    mimetype = request.mimetype
+    if mimetype not in JSON_MIMETYPES + MSGPACK_MIMETYPES and not mimetype.endswith('+json'):
+        raise PayloadError(415, "expected an application/json or application/msgpack body")
+    if mimetype in MSGPACK_MIMETYPES and msgpack is None:
+        raise PayloadError(415, "application/msgpack bodies are not supported on this server")
+    try:
+        body = request.get_data(cache=False)
+    except RequestEntityTooLarge:
+        raise PayloadError(413, "request body is too large")
+    if max_bytes and len(body) > max_bytes:
+        raise PayloadError(413, f"request body exceeds {max_bytes} bytes")
+    if not body:
+        raise PayloadError(400, "request body is empty")
+    try:
+        if mimetype in MSGPACK_MIMETYPES:
+            return msgpack.unpackb(body, raw=False, strict_map_key=False)
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+    except Exception as e:
+        raise PayloadError(400, f"could not decode request body: {e}")
+
+
+def check_table(table, where, label_column, max_rows, header=False):
+    # A table is a list of rows, a row a list of scalars. With label_column the first
+    # cell of every row (after the header when there is one) must be a string.
+    if not isinstance(table, list):
+        raise PayloadError(400, f"{where} must be a list of rows")
+    if max_rows and len(table) > max_rows:
+        raise PayloadError(413, f"{where} has {len(table)} rows, the limit is {max_rows}")
+    for row_idx, row in enumerate(table):
+        if not isinstance(row, list):
+            raise PayloadError(400, f"{where}[{row_idx}] must be a list")
+        for col_idx, cell in enumerate(row):
+            if not isinstance(cell, SCALAR_TYPES):
+                raise PayloadError(400, f"{where}[{row_idx}][{col_idx}] must be a string, number, boolean or null")
+        if label_column and not (header and row_idx == 0):
+            if not row or not isinstance(row[0], str):
+                raise PayloadError(400, f"{where}[{row_idx}][0] must be a string")
+            # Category labels repeat in every year; share one string object per label
+            row[0] = sys.intern(row[0])
+
+
+def validate_payload(payload, max_years=None, max_rows=None, derive_consolidated=False):
+    # One pass over the payload shape; returns (entries, consolidated_data). consolidated_data
+    # is None when it was left out (or derive_consolidated is set): the report then derives
+    # it from the combined tables (see report_aggregate).
+    if not isinstance(payload, dict):
+        raise PayloadError(400, "payload must be an object with 'data' and optionally 'consolidated'")
+    entries = payload.get('data', [])
+    consolidated_data = None if derive_consolidated else payload.get('consolidated')
+    if not isinstance(entries, list):
+        raise PayloadError(400, "data must be a list of yearly entries")
+    if max_years and len(entries) > max_years:
+        raise PayloadError(413, f"data has {len(entries)} years, the limit is {max_years}")
+
+    years = set()
+    for idx, entry in enumerate(entries):
+        where = f"data[{idx}]"
+        if not isinstance(entry, dict):
+            raise PayloadError(400, f"{where} must be an object")
+        if 'year' not in entry:
+            raise PayloadError(400, f"{where}.year is required")
+        year = entry['year']
+        if isinstance(year, bool) or not isinstance(year, (int, str)):
+            raise PayloadError(400, f"{where}.year must be an integer or a string")
+        year = str(year)
+        if not year or len(year) > SHEET_NAME_LIMIT or INVALID_SHEET_CHARS.search(year):
+            raise PayloadError(400, f"{where}.year {year!r} cannot be used in a sheet name")
+        if year in years:
+            raise PayloadError(400, f"{where}.year {year} appears more than once")
+        years.add(year)
+        for table in YEAR_TABLES:
+            if table not in entry:
+                raise PayloadError(400, f"{where}.{table} is required")
+            check_table(entry[table], f"{where}.{table}", table == 'combined', max_rows)
+
+    if consolidated_data is not None:
+        check_table(consolidated_data, "consolidated", True, max_rows, header=True)
+    return entries, consolidated_data
+
+
+def load_payload(request, max_bytes=None, max_years=None, max_rows=None, derive_consolidated=False):
+    return validate_payload(
+        decode_body(request, max_bytes), max_years=max_years, max_rows=max_rows,
+        derive_consolidated=derive_consolidated,
+    )
@@ -0,0 +1,288 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import xlsxwriter
+
+from report_compression import compression_profile
+from report_template import REPORT_TEMPLATE
+
+# Job state lives in SQLite next to the finished files, so any server process (and a
+# restarted one) can report status and serve downloads:
+#
+#   <directory>/jobs.sqlite3     one row per job
+#   <directory>/<id>.json        submitted payload, kept until the job is purged
+#   <directory>/<id>.xlsx        finished workbook
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    worker_pid INTEGER,
+    size INTEGER,
+    error TEXT
+)
+'''
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+LATENCY_WINDOW = 500  # finished jobs used for the latency stats
+
+
+def connect(directory):
+    conn = sqlite3.connect(os.path.join(directory, 'jobs.sqlite3'), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def run_job(directory, job_id):
+    # Runs in a worker process. The queued -> running update is the claim, so a job that
+    # was submitted by several server processes after a restart is only built once.
+    conn = connect(directory)
+    try:
+        claimed = conn.execute(
+            'UPDATE jobs SET status = ?, started = ?, worker_pid = ? WHERE id = ? AND status = ?',
+            (RUNNING, time.time(), os.getpid(), job_id, QUEUED),
+        ).rowcount
+        if not claimed:
+            return
+        path = os.path.join(directory, job_id + '.xlsx')
+        try:
+            with open(os.path.join(directory, job_id + '.json'), encoding='utf-8') as f:
+                payload = json.load(f)
+            workbook = xlsxwriter.Workbook(path + '.tmp', {'tmpdir': directory})
+            REPORT_TEMPLATE.render(workbook, payload.get('data', []), payload.get('consolidated'))
+            with compression_profile(payload.get('compression')):
+                workbook.close()
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?',
+                (FAILED, time.time(), f"{type(e).__name__}: {e}", job_id),
+            )
+            return
+        conn.execute(
+            'UPDATE jobs SET status = ?, finished = ?, size = ? WHERE id = ?',
+            (DONE, time.time(), os.path.getsize(path), job_id),
+        )
+    finally:
+        conn.close()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class ReportJobs:
+    # Asynchronous report builds on a bounded local process pool
+
+    def __init__(self, directory, max_workers, retention=None, max_queued=None):
+        self.directory = directory
+        self.max_workers = max_workers
+        self.retention = retention
+        self.max_queued = max_queued
+        os.makedirs(directory, exist_ok=True)
+        conn = connect(directory)
+        try:
+            conn.execute(SCHEMA)
+        finally:
+            conn.close()
+        self.pool = self._new_pool()
+        self.lock = threading.Lock()
+        self.pending = {}  # job id -> pool it was submitted to, until its future is done
+        self.closed = False
+        self.purge_expired()
+        self.recover()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _submit(self, job_id, retry=True):
+        with self.lock:
+            pool = self.pool
+            if self.pending.get(job_id) is pool:
+                # Already waiting on the live pool, e.g. retried there while the pool it
+                # was first sent to was being replaced
+                return
+            self.pending[job_id] = pool
+        try:
+            future = pool.submit(run_job, self.directory, job_id)
+        except BrokenProcessPool as e:
+            self._forget(job_id, pool)
+            if not retry:
+                self._fail(job_id, f"BrokenProcessPool: {e}")
+                return
+            # A worker died since the last job; retry once on the replacement pool
+            self._replace_pool(pool)
+            self._submit(job_id, retry=False)
+            return
+        future.add_done_callback(lambda future: self._done(job_id, pool, future))
+
+    def _forget(self, job_id, pool):
+        with self.lock:
+            if self.pending.get(job_id) is pool:
+                del self.pending[job_id]
+
+    def _done(self, job_id, pool, future):
+        self._forget(job_id, pool)
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace_pool(pool)
+
+    def _replace_pool(self, broken):
+        # A worker was killed (OOM kill, segfault), which breaks the whole pool: swap in a
+        # fresh one, then requeue the jobs that were running or waiting on the old one
+        with self.lock:
+            if self.closed or self.pool is not broken:
+                return
+            self.pool = self._new_pool()
+        threading.Thread(target=self._recover_after, args=(broken,), daemon=True).start()
+
+    def _recover_after(self, broken):
+        # Runs outside the pool's callbacks: shutdown() reaps the dead workers first, so
+        # recover() sees their pids as gone
+        broken.shutdown(wait=True, cancel_futures=True)
+        if not self.closed:
+            self.recover()
+
+    def _fail(self, job_id, error):
+        conn = connect(self.directory)
+        try:
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ? AND status = ?',
+                (FAILED, time.time(), error, job_id, QUEUED),
+            )
+        finally:
+            conn.close()
+
+    def close(self):
+        # Running jobs finish; cancelled ones are still queued in SQLite for the next start
+        with self.lock:
+            self.closed = True
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def recover(self):
+        # Requeue jobs whose worker process is gone (server restart, OOM kill) and pick up
+        # everything still queued
+        conn = connect(self.directory)
+        try:
+            for row in conn.execute('SELECT id, worker_pid FROM jobs WHERE status = ?', (RUNNING,)).fetchall():
+                if not row['worker_pid'] or not pid_alive(row['worker_pid']):
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, started = NULL, worker_pid = NULL WHERE id = ? AND status = ?',
+                        (QUEUED, row['id'], RUNNING),
+                    )
+            queued = [row['id'] for row in conn.execute(
+                'SELECT id FROM jobs WHERE status = ? ORDER BY submitted', (QUEUED,),
+            )]
+        finally:
+            conn.close()
+        for job_id in queued:
+            self._submit(job_id)
+
+    def queue_depth(self):
+        conn = connect(self.directory)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def submit(self, payload):
+        # Returns the new job id, or None when the queue is full
+        self.purge_expired()
+        if self.max_queued and self.queue_depth() >= self.max_queued:
+            return None
+        job_id = uuid.uuid4().hex
+        with open(os.path.join(self.directory, job_id + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        conn = connect(self.directory)
+        try:
+            conn.execute('INSERT INTO jobs (id, status, submitted) VALUES (?, ?, ?)', (job_id, QUEUED, time.time()))
+        finally:
+            conn.close()
+        self._submit(job_id)
+        return job_id
+
+    def get(self, job_id):
+        conn = connect(self.directory)
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = {key: row[key] for key in ('id', 'status', 'submitted', 'started', 'finished', 'size', 'error')}
+        if self.retention and row['finished']:
+            job['expires'] = row['finished'] + self.retention
+        return job
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, job_id + '.xlsx')
+
+    def purge_expired(self):
+        if not self.retention:
+            return
+        cutoff = time.time() - self.retention
+        conn = connect(self.directory)
+        try:
+            expired = [row['id'] for row in conn.execute(
+                'SELECT id FROM jobs WHERE status IN (?, ?) AND finished < ?', (DONE, FAILED, cutoff),
+            )]
+            for job_id in expired:
+                for suffix in ('.xlsx', '.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, job_id + suffix))
+                    except FileNotFoundError:
+                        pass
+                conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = connect(self.directory)
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            recent = conn.execute(
+                'SELECT submitted, started, finished FROM jobs WHERE status = ? ORDER BY finished DESC LIMIT ?',
+                (DONE, LATENCY_WINDOW),
+            ).fetchall()
+        finally:
+            conn.close()
+        latency = [row['finished'] - row['submitted'] for row in recent]
+        wait = [row['started'] - row['submitted'] for row in recent]
+        build = [row['finished'] - row['started'] for row in recent]
+        with self.lock:
+            in_flight = len(self.pending)
+        return {
+            'queue_depth': counts.get(QUEUED, 0),
+            'running': counts.get(RUNNING, 0),
+            'done': counts.get(DONE, 0),
+            'failed': counts.get(FAILED, 0),
+            'in_flight': in_flight,  # submitted to this process' pool and not finished
+            'workers': self.max_workers,
+            'latency_seconds': {'p50': percentile(latency, 50), 'p95': percentile(latency, 95)},
+            'queue_wait_seconds': {'p50': percentile(wait, 50), 'p95': percentile(wait, 95)},
+            'build_seconds': {'p50': percentile(build, 50), 'p95': percentile(build, 95)},
+            'pid': os.getpid(),
+        }
@@ -0,0 +1,262 @@
+import bisect
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from report_profiling import profile_lock
+
+# Per-process metrics in the Prometheus text format. Each server process keeps its own
+# registry, so scrape every worker (or run one worker per pod).
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+BYTES_BUCKETS = tuple(2 ** n for n in range(12, 31, 2))  # 4 KiB .. 1 GiB
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, value, labels=()):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {series[-1]}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, amount=1, labels=()):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{format_labels(labels)} {value}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        # collect() -> [(name, help, type, [(labels, value), ...])], called on each scrape
+        self.collectors.append(collect)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, help_text, metric_type, samples in collect():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter('report_requests_total', 'Report requests by endpoint and outcome.')
+REQUEST_SECONDS = REGISTRY.histogram('report_request_seconds', 'Wall time of sampled report requests.')
+PHASE_SECONDS = REGISTRY.histogram('report_phase_seconds', 'Time spent per phase of sampled report requests.')
+ROWS_WRITTEN = REGISTRY.histogram('report_rows_written', 'Rows written per report.', COUNT_BUCKETS)
+CHARTS_CREATED = REGISTRY.histogram('report_charts_created', 'Charts created per report.', COUNT_BUCKETS)
+SHEETS_CREATED = REGISTRY.histogram('report_sheets_created', 'Worksheets per report.', COUNT_BUCKETS)
+OUTPUT_BYTES = REGISTRY.histogram('report_output_bytes', 'Size of the generated file.', BYTES_BUCKETS)
+PEAK_MEMORY = REGISTRY.histogram(
+    'report_peak_memory_bytes', 'Peak Python heap growth while building a sampled report (tracemalloc).',
+    BYTES_BUCKETS,
+)
+
+
+def peak_rss_bytes():
+    # High-water mark of this process (ru_maxrss is KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+REGISTRY.add_collector(lambda: [
+    ('process_peak_rss_bytes', 'Peak resident set size of this process.', 'gauge', [((), peak_rss_bytes())]),
+])
+
+
+class PhaseTimer:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        phases = self.metrics.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.started
+
+
+class MemoryTracer:
+    # Peak of the memory traced by tracemalloc above what was allocated on entry, stored
+    # as metrics.peak_memory. ru_maxrss is a process-wide high-water mark that only moves
+    # when a report beats every earlier one, so it cannot give a per-report figure.
+    # tracemalloc is process-wide too: the profiler's lock keeps it to one traced request
+    # at a time (others are skipped, not delayed), and allocations of requests running
+    # next to it in other threads are included, so the value is an upper bound.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.tracing = False
+
+    def __enter__(self):
+        if not profile_lock.acquire(blocking=False):
+            return self
+        self.tracing = True
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc):
+        if not self.tracing:
+            return
+        try:
+            self.metrics.peak_memory = tracemalloc.get_traced_memory()[1] - self.baseline
+            if self.started_tracing:
+                tracemalloc.stop()
+        finally:
+            self.tracing = False
+            profile_lock.release()
+
+
+class RequestMetrics:
+    # Phase timings and counters of one sampled request, published in one go at the end
+
+    sampled = True
+
+    def __init__(self, endpoint, trace_memory=False):
+        self.endpoint = endpoint
+        self.trace_memory = trace_memory
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counts = {}
+        self.peak_memory = None
+
+    def phase(self, name):
+        return PhaseTimer(self, name)
+
+    def memory(self):
+        # Wraps the report build; a no-op unless the request was picked for memory tracing
+        return MemoryTracer(self) if self.trace_memory else NULL_TIMER
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def publish(self, outcome):
+        labels = (('endpoint', self.endpoint),)
+        elapsed = time.perf_counter() - self.started
+        with REGISTRY.lock:
+            REQUESTS.inc(labels=labels + (('outcome', outcome),))
+            REQUEST_SECONDS.observe(elapsed, labels)
+            for name, seconds in self.phases.items():
+                PHASE_SECONDS.observe(seconds, labels + (('phase', name),))
+            for metric, name in ((ROWS_WRITTEN, 'rows'), (CHARTS_CREATED, 'charts'),
+                                 (SHEETS_CREATED, 'sheets'), (OUTPUT_BYTES, 'bytes')):
+                if name in self.counts:
+                    metric.observe(self.counts[name], labels)
+            if self.peak_memory is not None:
+                PEAK_MEMORY.observe(self.peak_memory, labels)
+
+
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullMetrics:
+    # Stand-in for requests that are not sampled: every call is a no-op except the
+    # request counter
+
+    sampled = False
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def phase(self, name):
+        return NULL_TIMER
+
+    def memory(self):
+        return NULL_TIMER
+
+    def count(self, name, amount=1):
+        pass
+
+    def publish(self, outcome):
+        with REGISTRY.lock:
+            REQUESTS.inc(labels=(('endpoint', self.endpoint), ('outcome', outcome)))
+
+
+NULL_TIMER = NullTimer()
+NULL_METRICS = NullMetrics('none')
+
+
+def sampled(rate):
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def start_request(endpoint, sample_rate, memory_sample_rate=0):
+    # memory_sample_rate applies to the requests already sampled for timings
+    if sampled(sample_rate):
+        return RequestMetrics(endpoint, trace_memory=sampled(memory_sample_rate))
+    return NullMetrics(endpoint)
@@ -0,0 +1,417 @@
+import hashlib
+import json
+import math
+import struct
+import zlib
+from bisect import bisect_right
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+from report_batch import discard_executor
+from report_columns import NUMBER_TYPES
+from report_index import CategoryIndex
+from report_template import EMISSIONS_AXES, REPORT_TEMPLATE, SCOPE_PIE_OPTIONS
+
+# Browser previews of the report charts without Excel. chart_models() turns a payload
+# into the data each chart of the workbook plots (same specs, same row selection as
+# ReportTemplate), and render_svg() / render_png() draw one model with plain Python.
+# SVG is the full preview; the PNG rasterizer draws bars, wedges and legend swatches
+# but no text, as there is no font renderer without extra dependencies.
+PREVIEW_VERSION = 1  # bump when the drawing changes, it is part of the cache key
+
+CHART_WIDTH = 480  # XlsxWriter's default chart size in pixels
+CHART_HEIGHT = 288
+PALETTE = (
+    '#4472C4', '#ED7D31', '#A5A5A5', '#FFC000', '#5B9BD5', '#70AD47',
+    '#264478', '#9E480E', '#636363', '#997300', '#255E91', '#43682B',
+)
+FONT = 'font-family="Calibri, Arial, sans-serif"'
+
+
+def plot_value(value):
+    # Excel plots text and empty cells as 0
+    return value if isinstance(value, NUMBER_TYPES) else 0
+
+
+def row_values(row, count):
+    return [plot_value(row[col]) if col < len(row) else 0 for col in range(1, count + 1)]
+
+
+def chart_size(options):
+    options = options or {}
+    return round(CHART_WIDTH * options.get('x_scale', 1)), round(CHART_HEIGHT * options.get('y_scale', 1))
+
+
+def year_sheet_cell(entry, layout, row, col):
+    # Value of a "Year {year}" sheet cell as ReportTemplate writes it (later tables win)
+    value = None
+    cursor = 0
+    for step in layout:
+        table = entry[step['table']]
+        if cursor <= row < cursor + len(table) and col < len(table[row - cursor]):
+            value = table[row - cursor][col]
+        if step.get('advance'):
+            cursor += len(entry[step['advance']]) + 1
+    return value
+
+
+def chart_models(entries, consolidated_data=None, template=REPORT_TEMPLATE):
+    # One dict per chart, in workbook order:
+    #   {'id', 'sheet', 'type': 'column' | 'pie', 'title', 'categories', 'series': [{'name', 'values'}], ...}
+    if consolidated_data is None:
+        consolidated_data = template.consolidate(entries).table()
+    charts = []
+    if consolidated_data:
+        years = consolidated_data[0][1:]
+        index = CategoryIndex(consolidated_data)
+        for chart_number, spec in enumerate(template.consolidated_charts, 1):
+            if spec.get('scopes'):
+                rows = index.scope_total_rows(spec['scopes'])
+            else:
+                rows = index.category_rows(spec['categories'])
+            if not rows:
+                continue
+            width, height = chart_size(spec.get('options'))
+            charts.append({
+                'id': f"consolidated-{chart_number}",
+                'sheet': "Consolidated Totals",
+                'type': 'column',
+                'title': spec['title'],
+                'categories': [str(year) for year in years],
+                'series': [
+                    {'name': str(consolidated_data[row][0]), 'values': row_values(consolidated_data[row], len(years))}
+                    for row in rows
+                ],
+                'axes': [EMISSIONS_AXES['x_axis']['name'], EMISSIONS_AXES['y_axis']['name']],
+                'width': width,
+                'height': height,
+            })
+
+    total_pie = template.year_total_pie
+    for entry in entries:
+        year = entry['year']
+        first_row, label_col, last_row, _ = total_pie['categories']
+        value_col = total_pie['values'][1]
+        cells = [
+            (year_sheet_cell(entry, template.year_layout, row, label_col),
+             year_sheet_cell(entry, template.year_layout, row, value_col))
+            for row in range(first_row, last_row + 1)
+        ]
+        charts.append({
+            'id': f"year-{year}-total",
+            'sheet': f"Year {year}",
+            'type': 'pie',
+            'title': total_pie['title'].format(year=year),
+            'categories': ['' if label is None else str(label) for label, _ in cells],
+            'series': [{'name': total_pie['name'].format(year=year),
+                        'values': [plot_value(value) for _, value in cells]}],
+            'width': CHART_WIDTH,
+            'height': CHART_HEIGHT,
+        })
+
+        combined = entry['combined']
+        plan = template.year_plan(entry)
+        for spec, rows in zip(template.year_scope_pies, plan.pie_rows):
+            if not rows:
+                continue
+            width, height = chart_size(SCOPE_PIE_OPTIONS)
+            charts.append({
+                'id': f"year-{year}-scope-{spec['scope']}",
+                'sheet': f"Year Chart {year}",
+                'type': 'pie',
+                'title': f"Scope {spec['scope']} ({year})",
+                'categories': [str(combined[row][0]) for row in rows],
+                'series': [{'name': f"Scope {spec['scope']} Emissions for {year}",
+                            'values': [plot_value(combined[row][1]) for row in rows]}],
+                'width': width,
+                'height': height,
+            })
+    return charts
+
+
+def chart_key(chart, fmt):
+    data = json.dumps([PREVIEW_VERSION, fmt, chart], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def cache_key(key, fmt):
+    # The format is in the key hash too; the suffix lets /previews/<key>.<fmt> look it up
+    return f"{key}.{fmt}"
+
+
+def nice_step(span, ticks=5):
+    # 1, 2, 2.5 or 5 times a power of ten, giving about `ticks` gridlines over span
+    if span <= 0:
+        return 1
+    raw = span / ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for factor in (1, 2, 2.5, 5, 10):
+        if raw <= factor * magnitude:
+            return factor * magnitude
+    return 10 * magnitude
+
+
+def format_number(value):
+    if abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:.2f}".rstrip('0').rstrip('.')
+
+
+# Geometry shared by the SVG and PNG renderers -------------------------------------------
+
+def plot_layout(chart):
+    # Plot area and legend box for one chart: (left, top, right, bottom), legend x
+    width, height = chart['width'], chart['height']
+    legend_width = min(width * 0.35, 170)
+    left = 60 if chart['type'] == 'column' else 10
+    bottom = height - (34 if chart['type'] == 'column' else 10)
+    return (left, 36, width - legend_width - 10, bottom), width - legend_width
+
+
+def column_geometry(chart):
+    # Stacked columns: positives stack up from 0, negatives down
+    (left, top, right, bottom), _ = plot_layout(chart)
+    series = chart['series']
+    count = len(chart['categories'])
+    highs = [sum(max(s['values'][i], 0) for s in series) for i in range(count)]
+    lows = [sum(min(s['values'][i], 0) for s in series) for i in range(count)]
+    high, low = max(highs, default=0), min(lows, default=0)
+    step = nice_step(high - low)
+    axis_max = math.ceil(high / step) * step if high > 0 else 0
+    axis_min = math.floor(low / step) * step if low < 0 else 0
+    if axis_max == axis_min:
+        axis_max = axis_min + step
+
+    def y_of(value):
+        return bottom - (value - axis_min) / (axis_max - axis_min) * (bottom - top)
+
+    slot = (right - left) / max(count, 1)
+    bar = slot * 0.6
+    rects = []  # (x, y, w, h, series index)
+    for i in range(count):
+        x = left + slot * i + (slot - bar) / 2
+        up = down = 0
+        for s_idx, s in enumerate(series):
+            value = s['values'][i]
+            if value >= 0:
+                y0, y1 = y_of(up + value), y_of(up)
+                up += value
+            else:
+                y0, y1 = y_of(down), y_of(down + value)
+                down += value
+            if y1 - y0 > 0:
+                rects.append((x, y0, bar, y1 - y0, s_idx))
+    ticks = []
+    value = axis_min
+    while value <= axis_max + step / 2:
+        ticks.append((value, y_of(value)))
+        value += step
+    return rects, ticks, slot
+
+
+def pie_geometry(chart):
+    (left, top, right, bottom), _ = plot_layout(chart)
+    values = [max(value, 0) for value in chart['series'][0]['values']]
+    total = sum(values)
+    radius = max(min(right - left, bottom - top) / 2 - 4, 1)
+    center = ((left + right) / 2, (top + bottom) / 2)
+    # Clockwise from 12 o'clock, like Excel; angles in radians
+    bounds = [0.0]
+    for value in values:
+        bounds.append(bounds[-1] + (2 * math.pi * value / total if total else 0))
+    return center, radius, bounds, values, total
+
+
+# SVG -------------------------------------------------------------------------------------
+
+def svg_text(x, y, text, size=10, anchor='start', weight='normal', extra=''):
+    return (f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" text-anchor="{anchor}" font-weight="{weight}" '
+            f'{FONT}{extra}>{escape(text)}</text>')
+
+
+def svg_legend(chart, names, x):
+    parts = []
+    (_, top, _, bottom), _ = plot_layout(chart)
+    line = 14
+    y = max(top, (top + bottom) / 2 - line * len(names) / 2)
+    for idx, name in enumerate(names):
+        color = PALETTE[idx % len(PALETTE)]
+        parts.append(f'<rect x="{x:.1f}" y="{y + idx * line:.1f}" width="8" height="8" fill="{color}"/>')
+        label = name if len(name) <= 28 else name[:27] + '…'
+        parts.append(svg_text(x + 12, y + idx * line + 8, label, size=9))
+    return parts
+
+
+def render_svg(chart):
+    width, height = chart['width'], chart['height']
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">',
+        f'<rect width="{width}" height="{height}" fill="#FFFFFF" stroke="#D9D9D9"/>',
+        svg_text(width / 2, 22, chart['title'], size=14, anchor='middle', weight='bold'),
+    ]
+    (left, top, right, bottom), legend_x = plot_layout(chart)
+
+    if chart['type'] == 'column':
+        rects, ticks, slot = column_geometry(chart)
+        for value, y in ticks:
+            parts.append(f'<line x1="{left}" y1="{y:.1f}" x2="{right:.1f}" y2="{y:.1f}" stroke="#D9D9D9"/>')
+            parts.append(svg_text(left - 4, y + 3, format_number(value), size=9, anchor='end'))
+        for x, y, w, h, s_idx in rects:
+            parts.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" '
+                         f'fill="{PALETTE[s_idx % len(PALETTE)]}"/>')
+        for i, category in enumerate(chart['categories']):
+            parts.append(svg_text(left + slot * (i + 0.5), bottom + 12, category, size=9, anchor='middle'))
+        x_name, y_name = chart['axes']
+        parts.append(svg_text((left + right) / 2, height - 6, x_name, size=10, anchor='middle', weight='bold'))
+        parts.append(svg_text(12, (top + bottom) / 2, y_name, size=10, anchor='middle', weight='bold',
+                              extra=f' transform="rotate(-90 12 {(top + bottom) / 2:.1f})"'))
+        parts.extend(svg_legend(chart, [s['name'] for s in chart['series']], legend_x))
+    else:
+        (cx, cy), radius, bounds, values, total = pie_geometry(chart)
+        for idx, value in enumerate(values):
+            if not value:
+                continue
+            color = PALETTE[idx % len(PALETTE)]
+            start, end = bounds[idx], bounds[idx + 1]
+            if end - start >= 2 * math.pi - 1e-9:
+                parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{radius:.1f}" fill="{color}"/>')
+            else:
+                x0, y0 = cx + radius * math.sin(start), cy - radius * math.cos(start)
+                x1, y1 = cx + radius * math.sin(end), cy - radius * math.cos(end)
+                large = 1 if end - start > math.pi else 0
+                parts.append(f'<path d="M{cx:.1f},{cy:.1f} L{x0:.1f},{y0:.1f} '
+                             f'A{radius:.1f},{radius:.1f} 0 {large} 1 {x1:.1f},{y1:.1f} Z" '
+                             f'fill="{color}" stroke="#FFFFFF"/>')
+        # Data labels: value and percentage, as in the workbook
+        for idx, value in enumerate(values):
+            if not value:
+                continue
+            middle = (bounds[idx] + bounds[idx + 1]) / 2
+            x, y = cx + radius * 0.65 * math.sin(middle), cy - radius * 0.65 * math.cos(middle)
+            parts.append(svg_text(x, y, format_number(value), size=9, anchor='middle'))
+            parts.append(svg_text(x, y + 10, f"{100 * value / total:.0f}%", size=9, anchor='middle'))
+        parts.extend(svg_legend(chart, chart['categories'], legend_x))
+
+    parts.append('</svg>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+# PNG -------------------------------------------------------------------------------------
+
+def hex_color(color):
+    return bytes.fromhex(color[1:])
+
+
+class Canvas:
+    # RGB raster with span fills; everything the charts need is rectangles and pie spans
+
+    def __init__(self, width, height, background=b'\xff\xff\xff'):
+        self.width = width
+        self.height = height
+        self.rows = [bytearray(background * width) for _ in range(height)]
+
+    def fill_span(self, y, x0, x1, rgb):
+        x0, x1 = max(int(x0), 0), min(int(x1), self.width)
+        if 0 <= y < self.height and x1 > x0:
+            self.rows[y][x0 * 3:x1 * 3] = rgb * (x1 - x0)
+
+    def fill_rect(self, x, y, w, h, rgb):
+        for row in range(max(int(round(y)), 0), min(int(round(y + h)), self.height)):
+            self.fill_span(row, round(x), round(x + w), rgb)
+
+    def fill_pie(self, cx, cy, radius, bounds, colors):
+        # Per scanline, cut the chord of the circle where the wedge boundaries cross it and
+        # colour each piece by the wedge its midpoint falls in
+        for y in range(max(int(cy - radius), 0), min(int(cy + radius) + 1, self.height)):
+            dy = y + 0.5 - cy
+            if abs(dy) >= radius:
+                continue
+            half = math.sqrt(radius * radius - dy * dy)
+            x0, x1 = cx - half, cx + half
+            cuts = {x0, x1}
+            for angle in bounds[:-1]:  # the last bound is the first one again
+                direction = -math.cos(angle)
+                if direction and dy / direction > 0:
+                    x = cx + dy / direction * math.sin(angle)
+                    if x0 < x < x1:
+                        cuts.add(x)
+            cuts = sorted(cuts)
+            for a, b in zip(cuts, cuts[1:]):
+                mid = (a + b) / 2 - cx
+                angle = math.atan2(mid, -dy) % (2 * math.pi)
+                idx = min(bisect_right(bounds, angle) - 1, len(colors) - 1)
+                self.fill_span(y, round(a), round(b), colors[idx])
+
+    def png(self):
+        raw = b''.join(b'\x00' + bytes(row) for row in self.rows)
+
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        header = struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)
+        return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 6))
+                + chunk(b'IEND', b''))
+
+
+def render_png(chart):
+    canvas = Canvas(chart['width'], chart['height'])
+    (left, top, right, bottom), legend_x = plot_layout(chart)
+    grid = hex_color('#D9D9D9')
+    if chart['type'] == 'column':
+        rects, ticks, _ = column_geometry(chart)
+        for _, y in ticks:
+            canvas.fill_span(int(round(y)), left, right, grid)
+        for x, y, w, h, s_idx in rects:
+            canvas.fill_rect(x, y, w, h, hex_color(PALETTE[s_idx % len(PALETTE)]))
+        names = chart['series']
+    else:
+        (cx, cy), radius, bounds, values, total = pie_geometry(chart)
+        if total:
+            colors = [hex_color(PALETTE[idx % len(PALETTE)]) for idx in range(len(values))]
+            canvas.fill_pie(cx, cy, radius, bounds, colors)
+        names = chart['categories']
+    # Legend swatches only
+    line = 14
+    y = max(top, (top + bottom) / 2 - line * len(names) / 2)
+    for idx in range(len(names)):
+        canvas.fill_rect(legend_x, y + idx * line, 8, 8, hex_color(PALETTE[idx % len(PALETTE)]))
+    return canvas.png()
+
+
+# format -> (mimetype, renderer, worth a process pool). An SVG takes well under a
+# millisecond, less than shipping the chart to a worker; a PNG takes several.
+PREVIEW_FORMATS = {
+    'svg': ('image/svg+xml', render_svg, False),
+    'png': ('image/png', render_png, True),
+}
+
+
+def render_chart(fmt, chart):
+    # Module-level so it can run in the batch process pool
+    return PREVIEW_FORMATS[fmt][1](chart)
+
+
+def render_previews(charts, fmt, cache=None, executor=None, min_parallel=8):
+    # -> [(key, image bytes, cached)] in chart order. Charts missing from the cache are
+    # rendered on the executor (one task per chart) when there are at least min_parallel
+    # of them, inline otherwise (and when the executor's pool is broken).
+    keys = [chart_key(chart, fmt) for chart in charts]
+    images = [cache.get(cache_key(key, fmt)) if cache is not None else None for key in keys]
+    missing = [idx for idx, image in enumerate(images) if image is None]
+    rendered = None
+    if executor is not None and PREVIEW_FORMATS[fmt][2] and len(missing) >= min_parallel:
+        try:
+            futures = [executor.submit(render_chart, fmt, charts[idx]) for idx in missing]
+            rendered = [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A pool worker died (OOM kill, segfault); the next user gets a fresh pool
+            discard_executor(executor)
+    if rendered is None:
+        rendered = [render_chart(fmt, charts[idx]) for idx in missing]
+    for idx, image in zip(missing, rendered):
+        images[idx] = image
+    if cache is not None and missing:
+        cache.put_many([(cache_key(keys[idx], fmt), images[idx]) for idx in missing])
+    missing = set(missing)
+    return [(key, image, idx not in missing) for idx, (key, image) in enumerate(zip(keys, images))]
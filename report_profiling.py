@@ -0,0 +1,111 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+# On-demand profile of one request: cProfile of the request thread plus tracemalloc
+# allocation statistics, written to <directory>/<id>.prof (pstats, for snakeviz or
+# `python -m pstats`) and <directory>/<id>.txt (readable summary). Only one request is
+# profiled at a time; tracemalloc is process-wide, so allocations of requests running
+# next to it in other threads show up in the allocation tables as well.
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 30
+TRACEMALLOC_FRAMES = 10
+PROFILE_KINDS = {'prof': 'application/octet-stream', 'txt': 'text/plain'}
+
+profile_lock = threading.Lock()
+
+
+def purge_profiles(directory, retention=None, max_profiles=None):
+    # Delete profiles older than retention seconds, then the oldest beyond max_profiles
+    profiles = {}
+    for name in os.listdir(directory):
+        profile_id, kind = os.path.splitext(name)
+        if kind[1:] in PROFILE_KINDS:
+            path = os.path.join(directory, name)
+            try:
+                modified = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            paths, newest = profiles.get(profile_id, ([], 0))
+            profiles[profile_id] = (paths + [path], max(newest, modified))
+    # Newest first; ids start with their timestamp, which breaks ties within a second
+    ordered = sorted(profiles.items(), key=lambda item: (item[1][1], item[0]), reverse=True)
+    cutoff = time.time() - retention if retention else None
+    for rank, (_, (paths, modified)) in enumerate(ordered):
+        if (cutoff is not None and modified < cutoff) or (max_profiles and rank >= max_profiles):
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+class ProfileCapture:
+
+    def __init__(self, directory, label, retention=None, max_profiles=None):
+        self.directory = directory
+        self.label = label
+        self.retention = retention
+        self.max_profiles = max_profiles
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.profiler = cProfile.Profile()
+        self.summary = None
+
+    def path(self, kind):
+        return os.path.join(self.directory, f"{self.id}.{kind}")
+
+    def start(self):
+        # False when another request is being profiled
+        if not profile_lock.acquire(blocking=False):
+            return False
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        self.before = tracemalloc.take_snapshot()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        return True
+
+    def stop(self):
+        try:
+            self.profiler.disable()
+            seconds = time.perf_counter() - self.started
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if self.started_tracing:
+                tracemalloc.stop()
+            self.summary = {'id': self.id, 'seconds': seconds, 'peak_traced_bytes': peak}
+            self.write(after)
+            purge_profiles(self.directory, self.retention, self.max_profiles)
+        finally:
+            profile_lock.release()
+        return self.summary
+
+    def write(self, after):
+        os.makedirs(self.directory, exist_ok=True)
+        self.profiler.dump_stats(self.path('prof'))
+
+        report = io.StringIO()
+        report.write(f"{self.label}\n")
+        report.write(f"wall time {self.summary['seconds']:.3f} s, "
+                     f"peak traced memory {self.summary['peak_traced_bytes'] / 2 ** 20:.1f} MiB\n\n")
+        for sort in ('cumulative', 'tottime'):
+            report.write(f"== Top {TOP_FUNCTIONS} functions by {sort} time ==\n")
+            pstats.Stats(self.profiler, stream=report).sort_stats(sort).print_stats(TOP_FUNCTIONS)
+        # Ignore the profiler's and tracemalloc's own bookkeeping
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+        ]
+        report.write(f"== Top {TOP_ALLOCATIONS} allocation sites still alive at the end (by line) ==\n")
+        differences = after.filter_traces(filters).compare_to(self.before.filter_traces(filters), 'lineno')
+        for stat in differences[:TOP_ALLOCATIONS]:
+            report.write(f"{stat}\n")
+        with open(self.path('txt'), 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
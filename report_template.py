@@ -0,0 +1,435 @@
+import io
+
+import xlsxwriter
+
+from report_aggregate import aggregate_entries
+from report_columns import column_widths, scale_numbers, write_typed_row
+from report_compression import compression_profile
+from report_index import CategoryIndex
+from report_metrics import NULL_METRICS
+
+# Cell formats, created once per workbook from these specs
+FORMAT_SPECS = {
+    'bold': {'bold': True, 'align': 'center', 'valign': 'vcenter'},
+    'title': {
+        'bold': True, 'align': 'center', 'valign': 'vcenter', 'font_size': 12, 'bg_color': '#D9E1F2',
+    },
+    'center': {'align': 'center', 'valign': 'vcenter'},
+    'left': {'align': 'left', 'valign': 'vcenter'},
+    'decimal': {'num_format': '0.00', 'align': 'center', 'valign': 'vcenter'},
+}
+
+# Leyenda con fuente más pequeña, a la derecha del gráfico
+SMALL_LEGEND = {'font': {'size': 8}, 'position': 'right'}
+
+EMISSIONS_AXES = {'x_axis': {'name': 'Years'}, 'y_axis': {'name': 'Emissions (tCO2e)'}}
+
+# Stacked column charts on the "Consolidated Totals" sheet. Each series is one category
+# row (or SCOPE total row) of the consolidated table, plotted across the year columns of
+# the header row. 'below_table' anchors are offsets from the last row of the table.
+CONSOLIDATED_CHARTS = (
+    {
+        'title': 'Scope 1',
+        'categories': ("1.1", "1.2", "1.3", "1.4"),
+        'anchor': (2, 0), 'below_table': True,
+        'options': {'x_scale': 1.1, 'y_scale': 1.2},
+        'legend': SMALL_LEGEND,
+    },
+    {
+        'title': 'Scope 2',
+        'categories': ("2.1", "2.2"),
+        'anchor': (20, 0), 'below_table': True,
+        'options': {'x_scale': 1.1, 'y_scale': 1.2},
+        'legend': SMALL_LEGEND,
+    },
+    {
+        'title': 'Scope 3',
+        'categories': ("3.1", "3.2", "3.3", "3.4", "3.5", "3.6", "3.7"),
+        'anchor': (38, 0), 'below_table': True,
+        'options': {'x_scale': 1.1, 'y_scale': 1.2},
+        'legend': SMALL_LEGEND,
+    },
+    {
+        'title': 'Scope 1 & 2',
+        'scopes': (1, 2),
+        'anchor': (0, 6),
+    },
+    {
+        'title': 'Scopes',
+        'scopes': (1, 2, 3),
+        'anchor': (16, 6),
+    },
+)
+
+# Tables on each "Year {year}" sheet, top to bottom. The cursor advances by the length of
+# the 'advance' table plus a blank row (the comparison block is spaced by the summary).
+YEAR_SHEET_LAYOUT = (
+    {'table': 'summary', 'writer': 'data', 'advance': 'summary'},
+    {'table': 'comparison', 'writer': 'data', 'advance': 'summary'},
+    {'table': 'combined', 'writer': 'combined'},
+)
+
+# Pie of Scope 1/2/3 totals from the summary table, to the right of the tables
+YEAR_TOTAL_PIE = {
+    'name': 'Total Emissions (Scopes 1, 2, 3) - {year}',
+    'title': 'Scope 1, 2, 3 ({year})',
+    'categories': (2, 0, 4, 0),
+    'values': (2, 1, 4, 1),
+    'anchor': (1, 5),
+}
+
+# Per-scope pies on each "Year Chart {year}" sheet, built from the category rows inside
+# each SCOPE block of the combined table (see report_index.CategoryIndex). Pies over
+# consecutive rows plot the combined table on the "Year {year}" sheet directly; the others
+# (e.g. categories with subcategory rows in between) get a scratch table on the chart
+# sheet, as Excel charts need one range per series to cache their data.
+YEAR_SCOPE_PIES = (
+    {
+        'scope': 1,
+        'categories': ("1.1", "1.2", "1.3", "1.4"),
+        'anchor': (1, 5),
+        'fit_columns': True,
+    },
+    {
+        'scope': 2,
+        'categories': ("2.1", "2.2"),
+        'subcategories': True,
+        'anchor': (17, 5),
+    },
+    {
+        'scope': 3,
+        'categories': ("3.1", "3.2", "3.3", "3.4", "3.5", "3.6", "3.7"),
+        'anchor': (33, 5),
+    },
+)
+SCOPE_PIE_OPTIONS = {'x_scale': 1.5, 'y_scale': 1}
+SCOPE_PIE_SPACING = 15  # Espacio para el siguiente bloque
+
+
+def set_column_widths(worksheet, widths):
+    for col_idx, width in enumerate(widths):
+        worksheet.set_column(col_idx, col_idx, width)
+
+
+# Adjust column widths dynamically to the widest cell of each column over all tables
+def adjust_column_widths(worksheet, *tables):
+    set_column_widths(worksheet, column_widths(*tables))
+
+
+# Write combined scope data with left alignment for the first column
+def write_combined_data(worksheet, start_row, data, formats, title_style=None):
+    for row_num, row in enumerate(data):
+        # Apply title styling for the first row in each section
+        if row_num == 0 and title_style:
+            if len(row) > 1:  # Merge if more than one column
+                worksheet.merge_range(start_row, 0, start_row, len(row) - 1, row[0], title_style)
+            else:
+                worksheet.write(start_row, 0, row[0], title_style)
+        else:
+            write_typed_row(
+                worksheet, start_row + row_num, row, formats['decimal'], formats['center'], first_format=formats['left'],
+            )
+
+
+def write_data(worksheet, start_row, data, formats, title_style=None, data_style=None, scale=None):
+    data_style = data_style or formats['center']
+    if scale is not None:
+        data = data[:1] + scale_numbers(data[1:], scale) if title_style else scale_numbers(data, scale)
+    for row_num, row in enumerate(data):
+        if row_num == 0 and title_style:  # Apply title style for first row
+            # Write the header row with title_style (background color)
+            worksheet.write_row(start_row, 0, row, title_style)
+        else:
+            # Apply decimal format if the cell contains a number
+            write_typed_row(worksheet, start_row + row_num, row, formats['decimal'], data_style)
+
+
+# Same as write_data, with numbers converted from kg to t
+def write_data_2(worksheet, start_row, data, formats, title_style=None, data_style=None):
+    write_data(worksheet, start_row, data, formats, title_style, data_style, scale=0.001)
+
+
+def write_consolidated_data(worksheet, start_row, data, formats, title_style=None):
+    for row_num, row in enumerate(data):
+        if row_num == 0 and title_style:  # Apply title style for the header row
+            worksheet.write_row(start_row, 0, row, title_style)
+        else:
+            # Align first column to the left for non-header rows
+            write_typed_row(
+                worksheet, start_row + row_num, row, formats['decimal'], formats['center'], first_format=formats['left'],
+            )
+
+
+def row_span(rows):
+    # (first, last) of consecutive row numbers, None if there are gaps or no rows
+    if rows and rows[-1] - rows[0] == len(rows) - 1:
+        return rows[0], rows[-1]
+    return None
+
+
+class YearPlan:
+    # Everything about one year's sheets that depends only on its tables: the category
+    # index of the combined table, the column widths of the "Year {year}" sheet and, per
+    # scope pie, the combined rows it plots, their span when consecutive and otherwise the
+    # widths of its scratch table
+
+    def __init__(self, entry, scope_pies):
+        combined = entry['combined']
+        self.index = CategoryIndex(combined)
+        self.data_widths = column_widths(entry['summary'], entry['comparison'], combined)
+        self.pie_rows = []
+        self.pie_spans = []
+        self.pie_widths = []
+        for spec in scope_pies:
+            rows = self.index.category_rows(
+                spec['categories'], subcategories=spec.get('subcategories', False), block=spec['scope'],
+            )
+            span = row_span(rows)
+            self.pie_rows.append(rows)
+            self.pie_spans.append(span)
+            self.pie_widths.append(
+                None if span else column_widths([[combined[idx][0], combined[idx][1]] for idx in rows])
+            )
+
+
+class SheetSelection:
+    # Which parts of the report to build: the "Consolidated Totals" sheet, the sheets of
+    # the given years (None for all of them) and the charts. Years are compared as strings.
+
+    def __init__(self, consolidated=True, years=None, charts=True):
+        self.consolidated = consolidated
+        self.years = None if years is None else frozenset(str(year) for year in years)
+        self.charts = charts
+
+    def entries(self, entries):
+        if self.years is None:
+            return entries
+        return [entry for entry in entries if str(entry['year']) in self.years]
+
+    def cache_key(self):
+        # Extra report cache key parts; none for the full report, so its keys stay the same
+        if self.consolidated and self.years is None and self.charts:
+            return ()
+        return (self.consolidated, None if self.years is None else sorted(self.years), self.charts)
+
+
+FULL_REPORT = SheetSelection()
+
+WRITERS = {
+    'data': write_data,
+    'combined': write_combined_data,
+    'consolidated': write_consolidated_data,
+}
+
+
+class ReportTemplate:
+    # Declarative layout of the summary comparison report. Built once per process;
+    # each request only binds its data to it with render().
+
+    def __init__(self, format_specs, consolidated_charts, year_layout, year_total_pie, year_scope_pies):
+        self.format_specs = format_specs
+        self.consolidated_charts = consolidated_charts
+        self.year_layout = tuple(
+            dict(step, write=WRITERS[step['writer']]) for step in year_layout
+        )
+        self.year_total_pie = year_total_pie
+        self.year_scope_pies = year_scope_pies
+
+    def bind_formats(self, workbook):
+        return {name: workbook.add_format(spec) for name, spec in self.format_specs.items()}
+
+    def render(self, workbook, entries, consolidated_data=None, metrics=NULL_METRICS, selection=FULL_REPORT):
+        formats = self.bind_formats(workbook)
+        if selection.consolidated:
+            self.add_consolidated_sheet(workbook, entries, consolidated_data, formats, metrics, selection.charts)
+
+        # Crear gráficos de tipo pie en una nueva hoja para cada año
+        for entry in selection.entries(entries):
+            self.add_year_sheets(workbook, entry, formats, metrics, charts=selection.charts)
+
+        metrics.count('sheets', len(workbook.worksheets()))
+        metrics.count('charts', len(workbook.charts))
+
+    def add_consolidated_sheet(self, workbook, entries, consolidated_data, formats, metrics=NULL_METRICS,
+                               charts=True):
+        if consolidated_data is None:
+            with metrics.phase('aggregate'):
+                consolidated_data = self.consolidate(entries).table()
+
+        # Add Consolidated Totals sheet
+        with metrics.phase('write_sheets'):
+            consolidated_sheet = workbook.add_worksheet("Consolidated Totals")
+            write_consolidated_data(consolidated_sheet, 0, consolidated_data, formats, title_style=formats['title'])
+            adjust_column_widths(consolidated_sheet, consolidated_data)
+        metrics.count('rows', len(consolidated_data))
+
+        if not charts:
+            return
+        with metrics.phase('charts'):
+            consolidated_index = CategoryIndex(consolidated_data)
+            for spec in self.consolidated_charts:
+                self.add_consolidated_chart(workbook, consolidated_sheet, consolidated_data, consolidated_index, spec)
+
+    def consolidate(self, entries):
+        # Consolidated totals derived from the combined tables
+        return aggregate_entries(entries)
+
+    def tables(self, entries, consolidated_data=None, selection=FULL_REPORT):
+        # (sheet name, table name, rows) in the order render() writes them; the row model
+        # shared with the CSV and JSON exports
+        if selection.consolidated:
+            if consolidated_data is None:
+                consolidated_data = self.consolidate(entries).table()
+            yield "Consolidated Totals", 'consolidated', consolidated_data
+        for entry in selection.entries(entries):
+            for step in self.year_layout:
+                yield f"Year {entry['year']}", step['table'], entry[step['table']]
+
+    def year_plan(self, entry):
+        return YearPlan(entry, self.year_scope_pies)
+
+    def add_consolidated_chart(self, workbook, worksheet, consolidated_data, index, spec):
+        if spec.get('scopes'):
+            row_indices = index.scope_total_rows(spec['scopes'])
+        else:
+            row_indices = index.category_rows(spec['categories'])
+        # Ensure we have valid rows for the chart
+        if not row_indices:
+            return
+        years = consolidated_data[0][1:]  # Row 1 (excluding the "Category" header)
+        chart = workbook.add_chart({'type': 'column', 'subtype': 'stacked'})
+
+        # Add data series to the chart
+        for row_idx in row_indices:
+            chart.add_series({
+                'name': consolidated_data[row_idx][0],
+                'categories': [worksheet.name, 0, 1, 0, len(years)],  # Years
+                'values': [worksheet.name, row_idx, 1, row_idx, len(years)],  # Data values
+            })
+
+        # Configure chart axes and title
+        chart.set_title({'name': spec['title']})
+        chart.set_x_axis(EMISSIONS_AXES['x_axis'])
+        chart.set_y_axis(EMISSIONS_AXES['y_axis'])
+        chart.set_style(11)
+        if spec.get('legend'):
+            chart.set_legend(spec['legend'])
+
+        row, col = spec['anchor']
+        if spec.get('below_table'):
+            row += len(consolidated_data)
+        if spec.get('options'):
+            worksheet.insert_chart(row, col, chart, spec['options'])
+        else:
+            worksheet.insert_chart(row, col, chart)
+
+    def add_year_sheets(self, workbook, entry, formats, metrics=NULL_METRICS, charts=True):
+        year = entry['year']
+        combined = entry['combined']
+        # Without charts the SCOPE blocks are never looked at, so skip the plan
+        plan = self.year_plan(entry) if charts else None
+
+        with metrics.phase('write_sheets'):
+            # Crear la hoja principal del año con los datos originales
+            worksheet_data = workbook.add_worksheet(f"Year {year}")
+            row_cursor = 0
+            table_rows = {}
+            for step in self.year_layout:
+                table_rows[step['table']] = row_cursor
+                step['write'](worksheet_data, row_cursor, entry[step['table']], formats, title_style=formats['title'])
+                if step.get('advance'):
+                    row_cursor += len(entry[step['advance']]) + 1
+                metrics.count('rows', len(entry[step['table']]))
+
+            # Ajustar anchos de columna
+            if plan is not None:
+                set_column_widths(worksheet_data, plan.data_widths)
+            else:
+                adjust_column_widths(worksheet_data, entry['summary'], entry['comparison'], combined)
+
+        if plan is None:
+            return
+        with metrics.phase('charts'):
+            self.add_year_charts(
+                workbook, worksheet_data, year, combined, plan, formats, metrics, table_rows.get('combined', 0),
+            )
+
+    def add_year_charts(self, workbook, worksheet_data, year, combined, plan, formats, metrics, combined_row=0):
+        # Pie de Scope 1, 2 y 3 a partir de la tabla de resumen
+        spec = self.year_total_pie
+        pie_chart_scopes = workbook.add_chart({'type': 'pie'})
+        pie_chart_scopes.add_series({
+            'name': spec['name'].format(year=year),
+            'categories': [worksheet_data.name, *spec['categories']],
+            'values': [worksheet_data.name, *spec['values']],
+            'data_labels': {'value': True, 'percentage': True}
+        })
+        pie_chart_scopes.set_title({'name': spec['title'].format(year=year)})
+        worksheet_data.insert_chart(*spec['anchor'], pie_chart_scopes)
+
+        # Crear una nueva hoja para los gráficos del año
+        worksheet_chart = workbook.add_worksheet(f"Year Chart {year}")
+        temp_start_row = 0
+        for spec, relevant_rows, span, widths in zip(
+                self.year_scope_pies, plan.pie_rows, plan.pie_spans, plan.pie_widths):
+            if not relevant_rows:
+                continue
+            if span is not None:
+                # Filas consecutivas: el gráfico usa la tabla combinada de la hoja del año
+                source = (worksheet_data.name, combined_row + span[0], combined_row + span[1])
+            else:
+                last_row = self.write_scope_table(
+                    worksheet_chart, temp_start_row, combined, relevant_rows, widths, spec, formats, metrics,
+                )
+                source = (worksheet_chart.name, temp_start_row + 1, last_row)
+                temp_start_row = last_row + 1 + SCOPE_PIE_SPACING
+            self.add_scope_pie(workbook, worksheet_chart, year, source, spec)
+
+    def write_scope_table(self, worksheet_chart, temp_start_row, combined, relevant_rows, widths, spec, formats,
+                          metrics=NULL_METRICS):
+        # Scratch table of the pie's rows; returns its last row
+        # Agregar encabezado "tCO₂" en la segunda columna
+        worksheet_chart.write(temp_start_row, 1, "tCO₂", formats['title'])
+        temp_start_row += 1  # Avanzar una fila para no sobreescribir el encabezado
+        for i, idx in enumerate(relevant_rows):
+            worksheet_chart.write(temp_start_row + i, 0, combined[idx][0])  # Categorías
+            worksheet_chart.write(temp_start_row + i, 1, combined[idx][1], formats['decimal'])  # Valores
+        metrics.count('rows', len(relevant_rows) + 1)
+        if spec.get('fit_columns'):
+            # Ajustar anchos de columna para la tabla escrita
+            set_column_widths(worksheet_chart, widths)
+        return temp_start_row + len(relevant_rows) - 1
+
+    def add_scope_pie(self, workbook, worksheet_chart, year, source, spec):
+        # source: (sheet name, first row, last row) of the labels (column 0) and values (column 1)
+        sheet, first_row, last_row = source
+        scope = spec['scope']
+        pie_chart = workbook.add_chart({'type': 'pie'})
+        pie_chart.add_series({
+            'name': f'Scope {scope} Emissions for {year}',
+            'categories': [sheet, first_row, 0, last_row, 0],
+            'values': [sheet, first_row, 1, last_row, 1],
+            'data_labels': {'value': True, 'percentage': True}
+        })
+        pie_chart.set_title({'name': f'Scope {scope} ({year})'})
+        pie_chart.set_legend(SMALL_LEGEND)
+        # Insertar el gráfico a la derecha de la tabla
+        worksheet_chart.insert_chart(*spec['anchor'], pie_chart, SCOPE_PIE_OPTIONS)
+
+
+REPORT_TEMPLATE = ReportTemplate(
+    FORMAT_SPECS, CONSOLIDATED_CHARTS, YEAR_SHEET_LAYOUT, YEAR_TOTAL_PIE, YEAR_SCOPE_PIES,
+)
+
+
+def render_report_bytes(entries, consolidated_data, metrics=NULL_METRICS, compression=None, selection=FULL_REPORT):
+    # Build a report in memory and return the XLSX bytes. Module-level so it can run in
+    # worker processes.
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    REPORT_TEMPLATE.render(workbook, entries, consolidated_data, metrics, selection)
+    with metrics.phase('close'), compression_profile(compression):
+        workbook.close()
+    body = output.getvalue()
+    metrics.count('bytes', len(body))
+    return body
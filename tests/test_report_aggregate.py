@@ -0,0 +1,95 @@
+import math
+
+from payloads import generate_payload
+from report_aggregate import aggregate_entries, year_over_year
+
+
+def entry(year, rows, language='de'):
+    header = {1: "SCOPE 1 - Direkte Emissionen", 2: "SCOPE 2 - Indirekte Emissionen aus Energie"}
+    if language == 'en':
+        header = {1: "SCOPE 1 - Direct emissions", 2: "SCOPE 2 - Indirect emissions from energy"}
+    total = "GESAMT" if language == 'de' else "TOTAL"
+    combined = [["Alle Scopes", "tCO₂e"]]
+    for scope, categories in rows.items():
+        combined.append([header[scope], ""])
+        combined.extend(categories)
+        combined.append([total, sum(value for label, value in categories if label.count('.') == 1)])
+    return {'year': year, 'combined': combined}
+
+
+def test_matches_the_client_consolidated_table():
+    payload = generate_payload(years=4, scope3_categories=9, subcategories=2)
+    client = payload['consolidated']
+    table = aggregate_entries(payload['data']).table(header=client[0][0])
+    assert [row[0] for row in table] == [row[0] for row in client]
+    for ours, theirs in zip(table[1:], client[1:]):
+        assert all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(ours[1:], theirs[1:]))
+
+
+def test_missing_years_are_none():
+    entries = [
+        entry(2020, {1: [["1.1 Stationäre Verbrennung", 10.0], ["1.2 Mobile Verbrennung", 5.0]]}),
+        entry(2021, {1: [["1.1 Stationäre Verbrennung", 12.0]], 2: [["2.1 Eingekaufter Strom", 3.0]]}),
+        entry(2022, {1: [["1.2 Mobile Verbrennung", 4.0]]}),
+    ]
+    totals = aggregate_entries(entries)
+    assert totals.years == [2020, 2021, 2022]
+    scope1, scope2 = totals.scopes
+    assert [c['values'] for c in scope1['categories']] == [[10.0, 12.0, None], [5.0, None, 4.0]]
+    assert scope1['values'] == [15.0, 12.0, 4.0]
+    assert scope2['values'] == [None, 3.0, None]
+    assert scope2['categories'] == [{'code': "2.1", 'label': "2.1 Eingekaufter Strom", 'values': [None, 3.0, None]}]
+
+
+def test_renamed_labels_match_by_code():
+    entries = [
+        entry(2020, {1: [["1.1 Stationäre Verbrennung", 10.0]]}),
+        entry(2021, {1: [["1.1 Stationary combustion", 11.0]]}, language='en'),
+    ]
+    scope1, = aggregate_entries(entries).scopes
+    # One category across both years, labelled as in the latest year
+    assert scope1['categories'] == [{'code': "1.1", 'label': "1.1 Stationary combustion", 'values': [10.0, 11.0]}]
+    assert scope1['label'] == "SCOPE 1 - Direct emissions"
+
+
+def test_subtotals_sum_top_level_categories_only():
+    rows = {
+        1: [
+            ["1.1 Stationäre Verbrennung", 10.0],
+            ["1.1.1 Erdgas", 6.0],
+            ["1.1.2 Heizöl", 4.0],
+            ["1.10 Sonstige", 0.1],
+            ["1.2 Mobile Verbrennung", 0.2],
+            ["Anmerkung", 99.0],
+        ],
+    }
+    scope1, = aggregate_entries([entry(2020, rows)]).scopes
+    # Subcategories, unnumbered rows and the GESAMT row are not added; "1.10" sorts after "1.2"
+    assert [c['code'] for c in scope1['categories']] == ["1.1", "1.2", "1.10"]
+    assert scope1['values'] == [math.fsum([10.0, 0.1, 0.2])]
+
+
+def test_table_layout():
+    entries = [
+        entry(2020, {1: [["1.1 Stationäre Verbrennung", 1.0]], 2: [["2.1 Eingekaufter Strom", 2.0]]}),
+        entry(2021, {1: [["1.1 Stationäre Verbrennung", 3.0]]}),
+    ]
+    assert aggregate_entries(entries).table() == [
+        ["Category", 2020, 2021],
+        ["SCOPE 1 - Direkte Emissionen", 1.0, 3.0],
+        ["1.1 Stationäre Verbrennung", 1.0, 3.0],
+        ["SCOPE 2 - Indirekte Emissionen aus Energie", 2.0, None],
+        ["2.1 Eingekaufter Strom", 2.0, None],
+    ]
+
+
+def test_no_entries():
+    totals = aggregate_entries([])
+    assert totals.scopes == []
+    assert totals.table() == [["Category"]]
+
+
+def test_year_over_year():
+    assert year_over_year([100.0, 110.0, None, 50.0, 0.0, 5.0]) == [
+        None, (10.0, 0.1), None, None, (-50.0, -1.0), (5.0, None),
+    ]
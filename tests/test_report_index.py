@@ -0,0 +1,111 @@
+import pytest
+
+from payloads import SCENARIOS, generate_payload
+from report_index import CategoryIndex
+from report_template import YEAR_SCOPE_PIES
+
+# The row selection the year chart sheets used before CategoryIndex: per scope, the rows
+# between its header and the first GESAMT/TOTAL row after it whose label starts with one
+# of the category prefixes (and, for scope 1, not with a subcategory prefix)
+LEGACY_SCOPES = {
+    1: {
+        'header': lambda label: "SCOPE 1 - Direkte Emissionen" in label or "SCOPE 1 - Direct emissions" in label,
+        'select': lambda label: label.startswith(("1.1 ", "1.2 ", "1.3 ", "1.4 "))
+        and not label.startswith(("1.1.1", "1.1.2")),
+    },
+    2: {
+        'header': lambda label: "SCOPE 2" in label,
+        'select': lambda label: label.startswith(("2.1", "2.2")),
+    },
+    3: {
+        'header': lambda label: "SCOPE 3" in label,
+        'select': lambda label: label.startswith(("3.1 ", "3.2 ", "3.3 ", "3.4 ", "3.5 ", "3.6 ", "3.7 ")),
+    },
+}
+
+
+def legacy_block(combined, scope):
+    start = end = None
+    for row_idx, row in enumerate(combined):
+        if LEGACY_SCOPES[scope]['header'](row[0]):
+            start = row_idx + 1
+        if start and ("GESAMT" in row[0] or "TOTAL" in row[0]):
+            end = row_idx
+            break
+    return (start, end) if start and end else None
+
+
+def legacy_rows(combined, scope):
+    block = legacy_block(combined, scope)
+    if block is None:
+        return []
+    return [row_idx for row_idx in range(*block) if LEGACY_SCOPES[scope]['select'](combined[row_idx][0])]
+
+
+def pie_spec(scope):
+    return next(spec for spec in YEAR_SCOPE_PIES if spec['scope'] == scope)
+
+
+def combined_tables():
+    for name, shape in SCENARIOS.items():
+        for entry in generate_payload(**shape, with_consolidated=False)['data']:
+            yield pytest.param(entry['combined'], id=f"{name}-{entry['year']}")
+    # Scope 3 with more than 7 categories (3.10 ... 3.15 are not plotted)
+    yield pytest.param(
+        generate_payload(years=1, scope3_categories=15, subcategories=3, language='en')['data'][0]['combined'],
+        id='scope3-15-categories',
+    )
+
+
+COMBINED_TABLES = list(combined_tables())
+
+
+@pytest.mark.parametrize('combined', COMBINED_TABLES)
+@pytest.mark.parametrize('scope', [1, 2, 3])
+def test_block_matches_legacy_scan(combined, scope):
+    assert CategoryIndex(combined).blocks.get(scope) == legacy_block(combined, scope)
+
+
+@pytest.mark.parametrize('combined', COMBINED_TABLES)
+@pytest.mark.parametrize('scope', [1, 2, 3])
+def test_pie_rows_match_legacy_startswith(combined, scope):
+    spec = pie_spec(scope)
+    rows = CategoryIndex(combined).category_rows(
+        spec['categories'], subcategories=spec.get('subcategories', False), block=spec['scope'],
+    )
+    assert rows == legacy_rows(combined, scope)
+
+
+def test_missing_block_selects_nothing():
+    combined = [
+        ["Alle Scopes", "tCO₂e"],
+        ["SCOPE 1 - Direkte Emissionen", ""],
+        ["1.1 Stationäre Verbrennung", 10.0],
+        ["GESAMT", 10.0],
+    ]
+    index = CategoryIndex(combined)
+    assert index.category_rows(("2.1", "2.2"), subcategories=True, block=2) == []
+    assert legacy_rows(combined, 2) == []
+
+
+def test_rows_outside_the_block_are_ignored():
+    # "1.1" also appears after the block's total row, where the legacy scan never looked
+    combined = [
+        ["SCOPE 1 - Direct emissions", ""],
+        ["1.1 Stationary combustion", 1.0],
+        ["1.1.1 Natural gas", 0.5],
+        ["1.2 Mobile combustion", 2.0],
+        ["TOTAL", 3.0],
+        ["1.1 Stationary combustion", 99.0],
+    ]
+    index = CategoryIndex(combined)
+    assert index.category_rows(("1.1", "1.2"), block=1) == [1, 3] == legacy_rows(combined, 1)
+    assert index.codes["1.1"] == [1, 5]
+    assert index.subcodes["1.1"] == [2]
+
+
+def test_scope_total_rows():
+    combined = generate_payload(years=1, subcategories=0)['data'][0]['combined']
+    index = CategoryIndex(combined)
+    expected = [row_idx for row_idx, row in enumerate(combined) if row[0].startswith(("SCOPE 1", "SCOPE 2"))]
+    assert index.scope_total_rows((1, 2)) == expected
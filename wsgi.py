@@ -0,0 +1,17 @@
+from app import app, warm_up
+
+# Production entry point:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:application
+#
+# With preload_app the master imports this module once, so the report modules are
+# imported and the template warmed up before the workers are forked. Process pools
+# (batch, jobs) and the report cache are still created lazily inside each worker.
+
+
+def create_app():
+    warm_up()
+    return app
+
+
+application = create_app()